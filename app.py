@@ -1,81 +1,677 @@
 import os
 import sys
 import json
+import asyncio
+import concurrent.futures
+import time
+import queue
+import sqlite3
+import threading
+import uuid
 from datetime import datetime
 from PySide6.QtWidgets import *
 from PySide6.QtCore import *
 from PySide6.QtGui import *
-from responder import ChatGPT
+from responder import AsyncChatGPT, ChatGPT, create_retrieval_engine, RAG_PROMPT, strip_rag_context
+from openai_client import EventLoopThread, SharedAsyncClient, SharedClient
+from storage import ConversationStore, ConversationCache
+from document_cache import DocumentCache
+from icons import IconCache
+from markdown_renderer import MarkdownRenderer, plain_html, split_blocks
+from request_manager import RequestManager
+from rag import IndexingCancelled
+from context_window import ContextWindow, count_tokens
 from dotenv import load_dotenv, set_key, find_dotenv
 load_dotenv()
-import fitz  # PyMuPDF
-class ChatThread(QThread):
+
+# Streamed text is painted at most once per frame (~60 fps).
+STREAM_FRAME_INTERVAL_MS = 16
+
+# Older turns are folded into a running summary once the unsummarized part
+# of a conversation passes COMPACTION_THRESHOLD tokens; the last
+# KEEP_RECENT_MESSAGES are always sent verbatim.
+SUMMARY_MODEL = "gpt-4o-mini"
+COMPACTION_THRESHOLD = 3000
+KEEP_RECENT_MESSAGES = 6
+
+# Untitled conversations are named in batches of up to TITLE_BATCH_SIZE
+TITLE_MODEL = "gpt-4o-mini"
+TITLE_BATCH_SIZE = 20
+
+# Conversations whose messages stay in memory after being opened
+MAX_RESIDENT_CONVERSATIONS = 20
+
+# Chat requests streaming at once, across all conversations; more wait in a queue
+MAX_CONCURRENT_REQUESTS = 4
+
+# Stream chat replies with AsyncChatGPT on one shared event loop rather than
+# a pool worker each; MAX_CONCURRENT_REQUESTS still bounds them there
+ASYNC_CHAT_REQUESTS = True
+
+# The search runs once typing has paused this long
+SEARCH_DEBOUNCE_MS = 200
+
+# Opening a conversation renders only its latest MESSAGE_WINDOW messages;
+# scrolling within LOAD_OLDER_MARGIN pixels of the top renders the
+# MESSAGE_PAGE before them.
+MESSAGE_WINDOW = 40
+MESSAGE_PAGE = 40
+LOAD_OLDER_MARGIN = 200
+
+# Rendered chat documents kept for switching back to recent conversations
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Size of the avatar next to assistant messages
+AVATAR_SIZE = QSize(16, 16)
+
+# Markdown rendered by the worker pool is applied in batches this far apart
+RENDER_APPLY_INTERVAL_MS = 50
+
+
+class ChatRequest(QObject):
+    """One chat request for ``conversation``, run on the request manager's pool.
+
+    ``cancel`` aborts it mid-stream, or before it starts if it is still
+    waiting for a free worker.
+    """
+    # Whether run() only schedules the request instead of blocking a worker
+    asynchronous = False
     response_received = Signal(str)
+    delta_received = Signal(str)
+    first_token_received = Signal(float)
+    sources_found = Signal(object, list)
+    request_prepared = Signal(int, int)
+    # Attempt number, seconds until it is made and the kind of error that caused it
+    retrying = Signal(int, float, str)
+    # The part of the reply received before the request was cancelled
+    cancelled = Signal(str)
     error_occurred = Signal(str)
+    finished = Signal()
 
-    def __init__(self, chatbot, messages, rag, file_path):
+    def __init__(self, chatbot, conversation, messages, rag, file_path, context_window):
         super().__init__()
         self.chatbot = chatbot
-        self.messages = messages
+        self.conversation = conversation
+        self.messages = list(messages)
         self.rag = rag
         self.file_path = file_path
+        self.context_window = context_window
+        # Deltas delivered to the GUI so far, kept there to repaint the reply
+        self.received = []
+        self.cancel_event = threading.Event()
+        self.queued_at = None
+        self.started_at = None
+        # Cancelled while still waiting for a worker
+        self.skipped = False
+        self.done = threading.Event()
+        self._stream = None
+        self._stream_lock = threading.Lock()
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self._stream_lock:
+            self.abort()
+            waiting = not self.picked_up() and not self.skipped
+            # run() does nothing once a worker picks it up
+            self.skipped = self.skipped or waiting
+        if waiting:
+            self.cancelled.emit("")
+            self.finish()
+
+    def picked_up(self):
+        """Whether run() has begun; cancelling is then up to ``abort``."""
+        return self.started_at is not None
+
+    def abort(self):
+        if self._stream is not None:
+            # Closing the response aborts the blocking read in run()
+            self._stream.close()
+
+    def finish(self):
+        self.done.set()
+        self.finished.emit()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def report_retry(self, attempt, delay, error):
+        self.retrying.emit(attempt, delay, type(error).__name__)
+
+    def set_stream(self, stream):
+        with self._stream_lock:
+            self._stream = stream
+            if self.cancel_event.is_set():
+                stream.close()
 
     def run(self):
+        with self._stream_lock:
+            if self.skipped:
+                return
+            self.started_at = time.perf_counter()
+        try:
+            self.stream_reply()
+        finally:
+            self.finish()
+
+    def prepare_messages(self):
+        """The messages to send, with retrieved context, fit to the context window."""
+        # Retrieved context goes into this request only, never into history
+        request_messages = self.messages
+        if self.rag:
+            user_message = self.messages[-1]["content"]
+            contents, sources = self.chatbot.get_file_context(self.file_path, query=user_message)
+            self.sources_found.emit(self.messages[-1], sources)
+            request_messages = self.messages[:-1] + [{
+                "role": "user",
+                "content": RAG_PROMPT.format(query=user_message, contents=contents),
+                "query": user_message,
+            }]
+        model = self.chatbot.model
+        request_messages, tokens = self.context_window.fit(request_messages, model)
+        self.request_prepared.emit(tokens, self.context_window.budget(model))
+        return request_messages
+
+    def stream_reply(self):
+        parts = []
         try:
+            request_messages = self.prepare_messages()
+            started = time.perf_counter()
+            if self.cancel_event.is_set():
+                self.cancelled.emit("")
+                return
+            for delta in self.chatbot.stream_chat_completion(request_messages, on_open=self.set_stream,
+                                                             on_retry=self.report_retry,
+                                                             should_stop=self.cancel_event.is_set):
+                if self.cancel_event.is_set():
+                    break
+                if not parts:
+                    self.first_token_received.emit(time.perf_counter() - started)
+                parts.append(delta)
+                self.delta_received.emit(delta)
+            if self.cancel_event.is_set():
+                self.cancelled.emit("".join(parts))
+            else:
+                self.response_received.emit("".join(parts))
+        except Exception as e:
+            if self.cancel_event.is_set():
+                self.cancelled.emit("".join(parts))
+            else:
+                self.error_occurred.emit(str(e))
+        finally:
+            with self._stream_lock:
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = None
+
+
+class AsyncChatRequest(ChatRequest):
+    """A ChatRequest streamed by AsyncChatGPT on the shared event loop.
+
+    ``run`` only schedules it, so no thread is held while it waits on the
+    API; it starts once it gets one of the manager's ``slots``. Document
+    retrieval blocks, so with RAG on the messages are prepared in the
+    loop's default executor.
+    """
+    asynchronous = True
+
+    def __init__(self, chatbot, async_chatbot, conversation, messages, rag, file_path, context_window):
+        super().__init__(chatbot, conversation, messages, rag, file_path, context_window)
+        self.async_chatbot = async_chatbot
+        self._scheduled = False
+        self._task = None
+
+    def picked_up(self):
+        return self._scheduled
+
+    def abort(self):
+        if self._task is not None:
+            self.async_chatbot.shared_client.event_loop.call_soon(self._task.cancel)
+
+    def run(self, slots):
+        with self._stream_lock:
+            if self.skipped:
+                return
+            self._scheduled = True
+        self.async_chatbot.submit(self.stream_reply_async(slots))
+
+    async def stream_reply_async(self, slots):
+        with self._stream_lock:
+            self._task = asyncio.current_task()
+            if self.cancel_event.is_set():
+                self._task.cancel()
+        parts = []
+        try:
+            await slots.acquire()
+        except asyncio.CancelledError:
+            self.cancelled.emit("")
+            self.finish()
+            return
+        try:
+            self.started_at = time.perf_counter()
             if self.rag:
-                user_message = self.messages[-1]["content"]
-                if self.file_path.endswith('.pdf'):
-                    contents = self.get_pdf_contents(self.file_path)
-                else:
-                    contents = self.chatbot.get_file_contents(self.file_path, query=user_message)
-                self.messages[-1]["content"] = f"answer this query: {user_message} using following context \n {contents}"
-            response = self.chatbot.create_chat_completion(self.messages)
-            self.response_received.emit(response)
+                request_messages = await asyncio.to_thread(self.prepare_messages)
+            else:
+                request_messages = self.prepare_messages()
+            started = time.perf_counter()
+            async for delta in self.async_chatbot.stream_chat_completion(request_messages,
+                                                                         on_retry=self.report_retry):
+                if not parts:
+                    self.first_token_received.emit(time.perf_counter() - started)
+                parts.append(delta)
+                self.delta_received.emit(delta)
+            self.response_received.emit("".join(parts))
+        except asyncio.CancelledError:
+            self.cancelled.emit("".join(parts))
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+        finally:
+            slots.release()
+            with self._stream_lock:
+                self._task = None
+            self.finish()
+
+
+class IndexThread(QThread):
+    pages_parsed = Signal(int, int)
+    chunks_embedded = Signal(int, int)
+    indexing_finished = Signal(str)
+    indexing_cancelled = Signal(str)
+    error_occurred = Signal(str)
+
+    def __init__(self, retrieval_engine, file_path, parent=None):
+        super().__init__(parent)
+        self.retrieval_engine = retrieval_engine
+        self.file_path = file_path
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        try:
+            self.retrieval_engine.get_index(self.file_path, self.report_progress, self.cancel_event)
+            self.indexing_finished.emit(self.file_path)
+        except IndexingCancelled:
+            self.indexing_cancelled.emit(self.file_path)
         except Exception as e:
             self.error_occurred.emit(str(e))
 
-    def get_pdf_contents(self, file_path):
-        document = fitz.open(file_path)
-        contents = []
-        for page_num in range(len(document)):
-            page = document.load_page(page_num)
-            contents.append(page.get_text())
-        return "\n".join(contents)
+    def report_progress(self, stage, done, total):
+        if stage == "pages":
+            self.pages_parsed.emit(done, total)
+        else:
+            self.chunks_embedded.emit(done, total)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class SummaryRequest(QObject):
+    """Folds a conversation's older turns into its summary, as a coroutine on the shared event loop."""
+    summary_ready = Signal(object, str, int)
+    error_occurred = Signal(str)
+    finished = Signal()
+
+    def __init__(self, async_chatbot, conversation, parent=None):
+        super().__init__(parent)
+        self.async_chatbot = async_chatbot
+        self.conversation = conversation
+        # Copied here: loading messages off the GUI thread could unload ones it is reading
+        self.messages = list(conversation.messages)
+        self._future = None
+
+    def start(self):
+        self._future = self.async_chatbot.submit(self.summarize())
+
+    async def summarize(self):
+        try:
+            summary, covers = await self.conversation.summarize(self.async_chatbot, self.messages)
+            self.summary_ready.emit(self.conversation, summary, covers)
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+        finally:
+            self.finished.emit()
+
+    def cancel(self):
+        if self._future is not None:
+            self._future.cancel()
+
+    def wait(self, timeout=None):
+        if self._future is not None:
+            concurrent.futures.wait([self._future], timeout)
+
+
+class TitleRequester(QObject):
+    """Names conversations in batches, each batch a coroutine on the shared event loop.
+
+    Conversations queued in one pass of the GUI event loop (e.g. every
+    untitled one at startup) are sent TITLE_BATCH_SIZE to a request.
+    """
+    title_ready = Signal(object, str)
+    error_occurred = Signal(str)
+
+    def __init__(self, async_chatbot, parent=None):
+        super().__init__(parent)
+        self.async_chatbot = async_chatbot
+        self.pending = []
+        self.futures = set()
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(0)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def enqueue(self, conversation):
+        """Queue a conversation for naming; called on the GUI thread, which copies its first messages."""
+        conversation.titling = True
+        self.pending.append((conversation, conversation.first_messages(4)))
+        self.flush_timer.start()
+
+    def flush(self):
+        self.futures = {future for future in self.futures if not future.done()}
+        for start in range(0, len(self.pending), TITLE_BATCH_SIZE):
+            self.futures.add(self.async_chatbot.submit(self.name(self.pending[start:start + TITLE_BATCH_SIZE])))
+        self.pending = []
+
+    async def name(self, batch):
+        try:
+            titles = await Conversation.generate_titles(self.async_chatbot, [messages for _, messages in batch])
+            for (conversation, _), title in zip(batch, titles):
+                self.title_ready.emit(conversation, title)
+        except Exception as e:
+            for conversation, _ in batch:
+                conversation.titling = False
+            self.error_occurred.emit(str(e))
+
+    def stop(self):
+        """Give up on every batch not yet named."""
+        self.flush_timer.stop()
+        self.pending = []
+        for future in self.futures:
+            future.cancel()
+
+    def wait(self, timeout=None):
+        if self.futures:
+            concurrent.futures.wait(self.futures, timeout)
+
+
+class SearchThread(QThread):
+    """Matches titles and message text for the search bar off the GUI thread.
+
+    Only the newest query is run: older ones still queued are skipped and a
+    running one is interrupted. Results carry the query's generation so the
+    caller can drop any that are stale by the time they arrive.
+    """
+    results_ready = Signal(int, object, list)
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.jobs = queue.Queue()
+        self.running = False
 
+    def search(self, generation, text, titles):
+        self.jobs.put((generation, text, titles))
+        if self.running:
+            self.store.interrupt_search()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.store.interrupt_search()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            while job is not None:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            if job is None:
+                return
+            generation, text, titles = job
+            self.running = True
+            try:
+                hits = self.store.search(text)
+            except sqlite3.OperationalError as e:
+                if str(e) == "interrupted":
+                    # Interrupted for a newer query; rerun if the interrupt was meant for an older one
+                    if self.jobs.empty():
+                        self.jobs.put(job)
+                    continue
+                # Retrying a locked or unreadable database would spin; titles still match
+                hits = []
+            finally:
+                self.running = False
+            matched_ids = {conversation_id for conversation_id, title in titles if text in title.lower()}
+            matched_ids.update(hit["conversation_id"] for hit in hits)
+            self.results_ready.emit(generation, matched_ids, hits)
+
+
+def insert_blocks(cursor, html):
+    """Insert HTML at the cursor as blocks of their own.
+
+    The first block of an inserted fragment merges into the cursor's block
+    and loses its own format (code background, list membership), so a
+    placeholder block takes that merge and is removed afterwards.
+    """
+    cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+    start = cursor.position()
+    cursor.insertFragment(QTextDocumentFragment.fromHtml("<p>-</p>" + html))
+    placeholder = QTextCursor(cursor.document())
+    placeholder.setPosition(start)
+    placeholder.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor)
+    placeholder.removeSelectedText()
+
+
+class ConversationListModel(QAbstractListModel):
+    """The sidebar's view of the conversation list.
+
+    Wraps the window's list of conversations, which is only modified through
+    this model, and reports each change as row inserts, removes or data
+    changes so the view updates just the affected rows.
+    """
+
+    def __init__(self, conversations, parent=None):
+        super().__init__(parent)
+        self.conversations = conversations
+        self._rows = {}
+        self._reindex()
+
+    def _reindex(self):
+        self._rows = {conversation.id: row for row, conversation in enumerate(self.conversations)}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.conversations)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        conversation = self.conversations[index.row()]
+        if role == Qt.DisplayRole:
+            return conversation.title or "New Chat"
+        if role == Qt.ToolTipRole:
+            return f"{conversation.message_count()} messages"
+        if role == Qt.UserRole:
+            return conversation.id
+        return None
+
+    def row_of(self, conversation_id):
+        return self._rows.get(conversation_id)
+
+    def append(self, conversation):
+        row = len(self.conversations)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.conversations.append(conversation)
+        self._rows[conversation.id] = row
+        self.endInsertRows()
+
+    def remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        conversation = self.conversations.pop(row)
+        self._reindex()
+        self.endRemoveRows()
+        return conversation
+
+    def clear(self):
+        self.beginResetModel()
+        self.conversations.clear()
+        self._rows.clear()
+        self.endResetModel()
+
+    def conversation_changed(self, conversation):
+        row = self.row_of(conversation.id)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+
+class ConversationFilterProxy(QSortFilterProxyModel):
+    """Shows only the conversations whose ids are in ``matches`` (all when None)."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.matches = None
+
+    def set_matches(self, matches):
+        self.matches = matches
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.matches is None:
+            return True
+        return self.sourceModel().index(source_row, 0, source_parent).data(Qt.UserRole) in self.matches
 
 
 class Conversation:
-    def __init__(self, title=None):
+    def __init__(self, title=None, shared_client=None, cache=None):
+        self.id = uuid.uuid4().hex
         self.title = title
-        self.chatbot = ChatGPT(openai_api_key=os.getenv("OPENAI_API_KEY"))
-        self.messages = []
+        self.titling = False
+        self.chatbot = ChatGPT(shared_client=shared_client)
+        # Messages are None until first accessed when a cache is given
+        self._messages = []
+        self.stored_message_count = 0
+        self.cache = cache
+        # {"content": ..., "covers": n} summarizes messages[:n]
+        self.summary = None
+        # Bumped whenever the messages change; identifies rendered documents
+        self.version = 0
+        self.summarizing = False
         self.created_at = datetime.now()
 
+    @property
+    def messages(self):
+        if self._messages is None:
+            self._messages = self.cache.load(self)
+        elif self.cache is not None:
+            self.cache.touch(self)
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        self._messages = messages
+
+    def message_count(self):
+        return len(self._messages) if self._messages is not None else self.stored_message_count
+
+    def first_messages(self, count):
+        """The first ``count`` messages, read from the store without loading the rest."""
+        if self._messages is not None:
+            return self._messages[:count]
+        return self.cache.store.load_messages(self.id, count)
+
+    def unload(self):
+        """Drop the messages from memory; they are read back on next access."""
+        if self._messages is None:
+            return
+        self.stored_message_count = len(self._messages)
+        self._messages = None
+
     def add_message(self, role, content):
         self.messages.append({"role": role, "content": content})
-        if not self.title and len(self.messages) >= 4:
-            self.title = self.generate_title()
+        self.version += 1
 
-    def generate_title(self):
-        user_messages = [msg['content'] for msg in self.messages[:4]]
-        prompt = f'choose one word name for following conversation: \n {user_messages}'
+    def needs_title(self):
+        return not self.title and not self.titling and self.message_count() >= 4
 
-        title = self.chatbot.create_chat_completion(
-            [{'role': 'user', 'content': prompt}])
-
-        return title if title else "Untitled Chat"
+    @staticmethod
+    async def generate_titles(async_chatbot, transcripts):
+        """Name several conversations, given their first messages, with a single request."""
+        listing = "\n".join(
+            f"{number}: {[msg['content'] for msg in messages[:4]]}"
+            for number, messages in enumerate(transcripts, 1)
+        )
+        prompt = (
+            "choose one word name for each of the following conversations. "
+            "Reply with a JSON object mapping each conversation number to its name.\n"
+            f"{listing}"
+        )
+        reply = await async_chatbot.create_chat_completion(
+            [{'role': 'user', 'content': prompt}], model=TITLE_MODEL,
+            response_format={"type": "json_object"})
+        try:
+            names = json.loads(reply)
+        except (TypeError, json.JSONDecodeError):
+            names = {}
+        return [str(names.get(str(number)) or "Untitled Chat").strip()
+                for number in range(1, len(transcripts) + 1)]
+
+    def summarized_count(self):
+        return self.summary["covers"] if self.summary else 0
+
+    def request_messages(self):
+        """Messages to send: the running summary stands in for the turns it covers."""
+        if not self.summary:
+            return list(self.messages)
+        summary_message = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{self.summary['content']}",
+            "pinned": True,
+        }
+        return [summary_message] + self.messages[self.summary["covers"]:]
+
+    def needs_compaction(self):
+        if self.summarizing:
+            return False
+        pending = self.messages[self.summarized_count():-KEEP_RECENT_MESSAGES]
+        return bool(pending) and count_tokens(SUMMARY_MODEL, pending) > COMPACTION_THRESHOLD
+
+    async def summarize(self, async_chatbot, messages):
+        """Fold everything but the recent ``messages`` into the running summary."""
+        covers = len(messages) - KEEP_RECENT_MESSAGES
+        turns = "\n".join(f"{msg['role']}: {msg['content']}"
+                          for msg in messages[self.summarized_count():covers])
+        previous = self.summary["content"] if self.summary else "(none)"
+        prompt = (
+            "Update the summary of a conversation. Keep facts, decisions, names, "
+            "numbers and open questions; drop pleasantries. Reply with the summary only.\n\n"
+            f"Current summary:\n{previous}\n\nNew turns:\n{turns}"
+        )
+        summary = await async_chatbot.create_chat_completion(
+            [{'role': 'user', 'content': prompt}], model=SUMMARY_MODEL)
+        return summary, covers
 
     def to_dict(self):
         return {
+            "id": self.id,
             "title": self.title,
-            "messages": self.messages,
+            "messages": self._messages,
+            "summary": self.summary,
             "created_at": self.created_at.isoformat()
         }
 
     @classmethod
-    def from_dict(cls, data):
-        conv = cls(data["title"])
-        conv.messages = data["messages"]
+    def from_dict(cls, data, shared_client=None, cache=None):
+        """Build a conversation from a full dict, or from index metadata
+        (``message_count`` instead of ``messages``) to load messages lazily."""
+        conv = cls(data["title"], shared_client, cache)
+        conv.id = data.get("id") or conv.id
+        if "messages" in data:
+            conv.messages = data["messages"]
+            for message in conv.messages:
+                if message["role"] == "user":
+                    message["content"] = strip_rag_context(message["content"])
+        else:
+            conv.messages = None
+            conv.stored_message_count = data["message_count"]
+        conv.summary = data.get("summary")
         conv.created_at = datetime.fromisoformat(data["created_at"])
         return conv
 
@@ -87,18 +683,69 @@ class MainWindow(QMainWindow):
         self.setGeometry(200, 50, 100, 100)
         self.setMinimumSize(1000, 660)
 
+        self.shared_client = SharedClient()
+        self.event_loop = EventLoopThread()
+        # Both clients draw on the same rate-limit budgets
+        self.async_client = SharedAsyncClient(self.event_loop, scheduler=self.shared_client.scheduler)
+        self.retrieval_engine = None
         self.conversations = []
         self.current_conversation = None
         self.load_conversations()
         self.rag = False
         self.file_path = None
+        self.index_thread = None
+        # Index threads and summary requests still running, cancelled and joined on close
+        self.background_jobs = set()
+        self.context_window = ContextWindow()
 
         # Define is_dark_mode here
         self.is_dark_mode = False
 
+        # Streamed deltas are buffered here and painted by stream_timer
+        self.stream_buffer = []
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(STREAM_FRAME_INTERVAL_MS)
+        self.stream_timer.timeout.connect(self.flush_stream)
+
+        # Searches wait for a pause in typing, then run on search_thread
+        self.search_generation = 0
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.filter_conversations)
+        self.search_thread = SearchThread(self.store, self)
+        self.search_thread.results_ready.connect(self.handle_search_results)
+        self.search_thread.start()
+
+        # Assistant Markdown is rendered off the GUI thread; finished renders
+        # are applied together once render_timer fires
+        self.renderer = MarkdownRenderer(parent=self)
+        self.renderer.rendered.connect(self.handle_rendered)
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(RENDER_APPLY_INTERVAL_MS)
+        self.render_timer.timeout.connect(self.apply_renders)
+        # Streamed reply so far, and how many of its blocks are in the document for good
+        self.stream_text = ""
+        self.stream_committed = 0
+        self.stream_dirty = False
+        self.stream_tail = None
+
+        # Chat requests in flight, by conversation, on a pool of at most
+        # MAX_CONCURRENT_REQUESTS workers; stream_request is the one whose
+        # reply is being painted, if its conversation is open
+        self.requests = RequestManager(MAX_CONCURRENT_REQUESTS, self)
+        self.requests.requests_changed.connect(self.handle_requests_changed)
+        self.stream_request = None
+
         self.setup_ui()
         self.setup_chatgpt()
 
+        self.title_requester = TitleRequester(self.async_chatbot, self)
+        self.title_requester.title_ready.connect(self.handle_title)
+        self.title_requester.error_occurred.connect(self.handle_title_error)
+        self.request_titles(self.conversations)
+
         # Set default theme
         self.apply_theme()
 
@@ -117,17 +764,32 @@ class MainWindow(QMainWindow):
         # Add Search Bar for Conversations
         self.search_bar = QLineEdit()
         self.search_bar.setPlaceholderText("Search Conversations...")
-        self.search_bar.textChanged.connect(self.filter_conversations)
+        self.search_bar.textChanged.connect(self.search_timer.start)
         self.left_layout.addWidget(self.search_bar)
 
-        self.conversation_list = QListWidget()
+        self.conversation_model = ConversationListModel(self.conversations, self)
+        self.conversation_proxy = ConversationFilterProxy(self)
+        self.conversation_proxy.setSourceModel(self.conversation_model)
+        self.conversation_list = QListView()
+        self.conversation_list.setModel(self.conversation_proxy)
+        self.conversation_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Rows all share one height, so long lists scroll without measuring every row
+        self.conversation_list.setUniformItemSizes(True)
         self.conversation_list.setFixedHeight(300)
         self.conversation_list.setObjectName("conversation-list")
-        self.conversation_list.itemClicked.connect(self.switch_conversation)
+        self.conversation_list.clicked.connect(self.switch_conversation)
         self.conversation_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.conversation_list.customContextMenuRequested.connect(self.show_context_menu)
         self.left_layout.addWidget(self.conversation_list)
 
+        # Message hits for the search bar text; hidden while there are none
+        self.search_results = QListWidget()
+        self.search_results.setObjectName("search-results")
+        self.search_results.setWordWrap(True)
+        self.search_results.itemClicked.connect(self.open_search_result)
+        self.search_results.hide()
+        self.left_layout.addWidget(self.search_results)
+
         clear_btn = QPushButton("Clear conversations")
         clear_btn.setObjectName("clear-btn")
         clear_btn.clicked.connect(self.clear_conversations)
@@ -175,12 +837,20 @@ class MainWindow(QMainWindow):
         self.chat_display = QTextEdit()
         self.chat_display.setReadOnly(True)
         self.chat_display.setObjectName("chat-display")
+        self.chat_display.verticalScrollBar().valueChanged.connect(self.handle_chat_scroll)
         right_layout.addWidget(self.chat_display)
+        # Oldest message of the current conversation rendered in chat_display
+        self.first_rendered_seq = 0
+        # Conversation version the displayed document shows; None once it diverges
+        self.chat_document_version = None
+        self.document_cache = DocumentCache(RENDER_CACHE_MAX_BYTES)
+        self.icons = IconCache()
+        self.clear_chat_display()
 
         input_layout = QHBoxLayout()
 
         self.upload_button = QPushButton()
-        self.upload_button.setIcon(QIcon("document.png"))
+        self.upload_button.setIcon(self.icons.icon("document.png", self.upload_button.iconSize()))
         self.upload_button.setObjectName("upload-btn")
         self.upload_button.clicked.connect(self.upload_document)
         input_layout.addWidget(self.upload_button)
@@ -191,28 +861,42 @@ class MainWindow(QMainWindow):
         self.input_field.returnPressed.connect(self.send_message)
         input_layout.addWidget(self.input_field)
 
-        send_btn = QPushButton("Send")
-        send_btn.setObjectName("send-btn")
-        send_btn.clicked.connect(self.send_message)
-        input_layout.addWidget(send_btn)
+        # Turns into "Stop" while the open conversation waits for a reply
+        self.send_button = QPushButton("Send")
+        self.send_button.setObjectName("send-btn")
+        self.send_button.clicked.connect(self.send_or_stop)
+        input_layout.addWidget(self.send_button)
 
         right_layout.addLayout(input_layout)
 
+        # Indexing progress lives in the status bar and is hidden when idle
+        self.index_progress = QProgressBar()
+        self.index_progress.setFixedWidth(200)
+        self.index_progress.hide()
+        self.cancel_index_btn = QPushButton("Cancel")
+        self.cancel_index_btn.setObjectName("cancel-index-btn")
+        self.cancel_index_btn.clicked.connect(self.cancel_indexing)
+        self.cancel_index_btn.hide()
+        self.token_label = QLabel()
+        self.token_label.setObjectName("token-label")
+        self.statusBar().addPermanentWidget(self.token_label)
+        self.statusBar().addPermanentWidget(self.index_progress)
+        self.statusBar().addPermanentWidget(self.cancel_index_btn)
+
         main_layout.addWidget(self.left_widget, 1)
         main_layout.addWidget(right_widget, 3)
 
         self.apply_macos_style()
-        self.update_conversation_list()
 
     def apply_light_theme(self):
         light_theme = open('light_theme.css', 'r', encoding='utf-8').read()
         self.setStyleSheet(light_theme)
-        self.upload_button.setIcon(QIcon("document.png"))
+        self.upload_button.setIcon(self.icons.icon("document.png", self.upload_button.iconSize()))
 
     def apply_dark_theme(self):
         dark_theme = open('dark_theme.css', 'r', encoding='utf-8').read()
         self.setStyleSheet(dark_theme)
-        self.upload_button.setIcon(QIcon("document_dark.png"))
+        self.upload_button.setIcon(self.icons.icon("document_dark.png", self.upload_button.iconSize()))
 
     def apply_macos_style(self):
         if self.is_dark_mode:
@@ -252,7 +936,10 @@ class MainWindow(QMainWindow):
                 else:
                     QMessageBox.critical(self, "API Key Error", "API key is required to proceed.")
                     sys.exit(1)
-            self.chatbot = ChatGPT(OPENAI_KEY, model="gpt-3.5-turbo")
+            self.shared_client.api_key = OPENAI_KEY
+            self.async_client.api_key = OPENAI_KEY
+            self.chatbot = ChatGPT(model="gpt-3.5-turbo", shared_client=self.shared_client)
+            self.async_chatbot = AsyncChatGPT(self.async_client, model=self.chatbot.model)
         
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to initialize ChatGPT: {str(e)}")
@@ -270,63 +957,373 @@ class MainWindow(QMainWindow):
                     dotenv_path = find_dotenv()
                 set_key(dotenv_path, "OPENAI_API_KEY", new_key)
                 os.environ["OPENAI_API_KEY"] = new_key
-                self.chatbot = ChatGPT(new_key, model=self.model_dropdown.currentText())
+                # Every ChatGPT shares this client, so all of them pick up the new key
+                self.shared_client.reset(new_key)
+                self.async_client.reset(new_key)
+                self.retrieval_engine = None
+                self.chatbot.retrieval_engine = None
                 QMessageBox.information(self, "Success", "API Key updated successfully.")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to update API Key: {str(e)}")
 
     def new_chat(self):
-        new_conversation = Conversation()
-        self.conversations.append(new_conversation)
-        self.current_conversation = new_conversation
-        self.update_conversation_list()
+        new_conversation = Conversation(shared_client=self.shared_client,
+                                        cache=self.conversation_cache)
+        self.conversation_model.append(new_conversation)
+        self.detach_stream()
+        self.stash_chat_document()
+        self.set_current_conversation(new_conversation)
         self.clear_chat_display()
-
-    def switch_conversation(self, item):
-        index = self.conversation_list.row(item)
-        self.current_conversation = self.conversations[index]
-        self.clear_chat_display()
-        self.display_conversation()
+        self.chat_document_version = new_conversation.version
+        self.update_send_button()
+
+    def open_conversation(self, conversation):
+        self.detach_stream()
+        self.stash_chat_document()
+        self.set_current_conversation(conversation)
+        if not self.restore_chat_document(conversation):
+            self.clear_chat_display()
+            self.display_conversation()
+        # A reply still streaming in is picked up where it is
+        for request in self.requests.active(conversation):
+            self.attach_stream(request)
+        self.update_send_button()
+
+    def set_current_conversation(self, conversation):
+        # The open conversation keeps its messages in memory
+        if self.current_conversation is not None:
+            self.conversation_cache.unpin(self.current_conversation)
+        self.current_conversation = conversation
+        if conversation is not None:
+            self.conversation_cache.pin(conversation)
+
+    def conversation_row(self, index):
+        """Position in self.conversations of a row in the (filtered) list view."""
+        return self.conversation_proxy.mapToSource(index).row()
+
+    def switch_conversation(self, index):
+        self.open_conversation(self.conversations[self.conversation_row(index)])
         self.title_label.setText(self.current_conversation.title)
 
     def handle_response(self, response):
-        self.current_conversation.add_message("assistant", response)
-        self.display_message("ChatGPT", response)
-        self.save_conversations()
-        self.update_conversation_list()
+        self.finish_reply(self.sender(), response)
+
+    def handle_cancelled(self, partial):
+        request = self.sender()
+        if partial:
+            # Keep what was already received (and paid for)
+            self.finish_reply(request, partial)
+        elif request is self.stream_request:
+            self.end_stream()
+            self.chat_document_version = None
+        self.statusBar().showMessage("Reply stopped", 3000)
+
+    def finish_reply(self, request, response):
+        """Add a reply to the conversation it was requested for, open or not."""
+        conversation = request.conversation
+        if self.conversation_model.row_of(conversation.id) is None:
+            # Deleted while the reply was on its way
+            return
+        shown = request is self.stream_request
+        if shown:
+            self.end_stream()
+        conversation.add_message("assistant", response)
+        if shown:
+            self.chat_document_version = conversation.version
+        self.save_conversation(conversation)
+        self.conversation_model.conversation_changed(conversation)
+        self.request_titles([conversation])
+        self.compact_conversation(conversation)
+
+    def request_titles(self, conversations):
+        for conversation in conversations:
+            if conversation.needs_title():
+                self.title_requester.enqueue(conversation)
+
+    def handle_title(self, conversation, title):
+        conversation.titling = False
+        if conversation.title or self.conversation_model.row_of(conversation.id) is None:
+            return
+        conversation.title = title
+        self.save_conversation(conversation)
+        self.conversation_model.conversation_changed(conversation)
+
+    def handle_title_error(self, error_message):
+        self.statusBar().showMessage(f"Naming conversations failed: {error_message}", 5000)
+
+    def closeEvent(self, event):
+        self.requests.cancel_all()
+        self.requests.wait_all()
+        self.title_requester.stop()
+        self.search_thread.stop()
+        for job in self.background_jobs:
+            job.cancel()
+        # Closing the connections ends requests the index threads are still waiting on
+        self.shared_client.close()
+        self.title_requester.wait()
+        self.search_thread.wait()
+        for job in list(self.background_jobs):
+            job.wait()
+        self.renderer.shutdown()
+        self.async_client.close()
+        self.event_loop.stop()
+        super().closeEvent(event)
+
+    def compact_conversation(self, conversation):
+        if not conversation.needs_compaction():
+            return
+        conversation.summarizing = True
+        summary_request = SummaryRequest(self.async_chatbot, conversation, self)
+        summary_request.summary_ready.connect(self.handle_summary)
+        summary_request.error_occurred.connect(self.handle_summary_error)
+        self.start_background_job(summary_request)
+
+    def start_background_job(self, job):
+        """Start an index thread or summary request, tracked until it finishes."""
+        self.background_jobs.add(job)
+        job.finished.connect(self.handle_background_job_finished)
+        job.start()
+
+    def handle_background_job_finished(self):
+        job = self.sender()
+        self.background_jobs.discard(job)
+        job.deleteLater()
+
+    def handle_summary(self, conversation, summary, covers):
+        conversation.summarizing = False
+        if self.conversation_model.row_of(conversation.id) is None:
+            return
+        if summary and covers > conversation.summarized_count():
+            conversation.summary = {"content": summary, "covers": covers}
+            self.save_conversation(conversation)
+
+    def handle_summary_error(self, error_message):
+        self.sender().conversation.summarizing = False
+        self.statusBar().showMessage(f"Summarizing failed: {error_message}", 5000)
+
+    def send_or_stop(self):
+        if self.current_conversation and self.requests.is_active(self.current_conversation):
+            self.requests.cancel(self.current_conversation)
+        else:
+            self.send_message()
 
     def send_message(self):
         if not self.current_conversation:
             self.new_chat()
         user_message = self.input_field.text().strip()
-        if not user_message:
+        if not user_message or self.requests.is_active(self.current_conversation):
             return
 
         self.current_conversation.add_message("user", user_message)
 
-        self.display_message("You", user_message)
+        self.display_message("You", user_message,
+                             anchor=f"message-{self.current_conversation.message_count() - 1}")
+        self.chat_document_version = self.current_conversation.version
         self.input_field.clear()
 
-        self.chat_thread = ChatThread(
-            self.chatbot, self.current_conversation.messages, self.rag, self.file_path
-        )
-        self.chat_thread.response_received.connect(self.handle_response)
-        self.chat_thread.error_occurred.connect(self.handle_error)
-        self.chat_thread.start()
-
-        self.update_conversation_list()
+        if ASYNC_CHAT_REQUESTS:
+            chat_request = AsyncChatRequest(
+                self.chatbot, self.async_chatbot, self.current_conversation,
+                self.current_conversation.request_messages(), self.rag, self.file_path, self.context_window
+            )
+        else:
+            chat_request = ChatRequest(
+                self.chatbot, self.current_conversation, self.current_conversation.request_messages(),
+                self.rag, self.file_path, self.context_window
+            )
+        chat_request.delta_received.connect(self.handle_delta)
+        chat_request.first_token_received.connect(self.handle_first_token)
+        chat_request.sources_found.connect(self.handle_sources)
+        chat_request.request_prepared.connect(self.handle_request_prepared)
+        chat_request.retrying.connect(self.handle_retrying)
+        chat_request.response_received.connect(self.handle_response)
+        chat_request.cancelled.connect(self.handle_cancelled)
+        chat_request.error_occurred.connect(self.handle_error)
+        stats = self.requests.stats()
+        if stats["running"] + stats["waiting"] >= stats["max_concurrent"]:
+            self.statusBar().showMessage(
+                f"Waiting for a free worker: {stats['max_concurrent']} replies are already streaming")
+        self.begin_stream(chat_request)
+        self.requests.start(chat_request)
+
+        self.conversation_model.conversation_changed(self.current_conversation)
+
+    def handle_requests_changed(self, conversation):
+        if conversation is self.current_conversation:
+            self.update_send_button()
+
+    def update_send_button(self):
+        active = self.current_conversation is not None and self.requests.is_active(self.current_conversation)
+        self.send_button.setText("Stop" if active else "Send")
+
+    def handle_delta(self, delta):
+        request = self.sender()
+        request.received.append(delta)
+        if request is self.stream_request:
+            self.stream_buffer.append(delta)
+
+    def handle_request_prepared(self, tokens, budget):
+        if self.sender() is self.stream_request:
+            self.token_label.setText(f"Request: {tokens:,} / {budget:,} tokens")
+
+    def handle_retrying(self, attempt, delay, error_name):
+        scheduler = self.shared_client.scheduler
+        self.statusBar().showMessage(
+            f"API busy ({error_name}), retry {attempt} of {scheduler.max_retries} in {delay:.1f} s;"
+            f" {scheduler.stats()['waiting']} requests waiting", int(delay * 1000) + 2000)
+
+    def handle_sources(self, message, sources):
+        message["sources"] = sources
+
+    def handle_first_token(self, seconds):
+        if self.sender() is self.stream_request:
+            self.flush_stream()
+            self.statusBar().showMessage(f"First token in {seconds:.2f} s")
+
+    def attach_stream(self, request):
+        """Paint a reply already in flight into the open conversation."""
+        self.begin_stream(request)
+        self.stream_buffer.extend(request.received)
+        self.flush_stream()
+
+    def detach_stream(self):
+        """Stop painting the streamed reply, e.g. when its conversation is left.
+
+        The request keeps running; its reply is added to its conversation
+        when it arrives.
+        """
+        if self.stream_request is None:
+            return
+        self.stream_timer.stop()
+        self.stream_buffer.clear()
+        self.stream_tail = None
+        self.stream_request = None
+        # The document holds a partial reply that is not in the conversation
+        self.chat_document_version = None
+
+    def begin_stream(self, request):
+        self.stream_request = request
+        self.stream_buffer.clear()
+        self.stream_text = ""
+        self.stream_committed = 0
+        self.stream_dirty = False
+        seq = self.current_conversation.message_count()
+        self.chat_display.append(f'<a name="message-{seq}"></a>' + self.message_html("ChatGPT", ""))
+        # Start of the part of the reply that is replaced on every frame
+        self.stream_tail = QTextCursor(self.chat_display.document())
+        self.stream_tail.movePosition(QTextCursor.End)
+        self.stream_tail.setKeepPositionOnInsert(True)
+        self.stream_timer.start()
+
+    def flush_stream(self, final=False):
+        """Paint the streamed reply: finished Markdown blocks are inserted once,
+        only the trailing block is replaced each frame. With ``final`` every
+        block is rendered now, on this thread if need be."""
+        if self.stream_tail is None or (not self.stream_buffer and not self.stream_dirty and not final):
+            return
+        self.stream_text += "".join(self.stream_buffer)
+        self.stream_buffer.clear()
+        self.stream_dirty = False
+        blocks = split_blocks(self.stream_text)
+        while not final and self.stream_committed < len(blocks) - 1:
+            rendered = self.renderer.block_html(blocks[self.stream_committed])
+            if rendered is None:
+                break
+            end = self.replace_stream_tail([rendered])
+            self.stream_committed += 1
+            self.stream_tail.setPosition(end)
+        parts = []
+        for index in range(self.stream_committed, len(blocks)):
+            if final:
+                parts.append(self.renderer.render_now(blocks[index]))
+                continue
+            rendered = self.renderer.block_html(blocks[index], final=index < len(blocks) - 1)
+            parts.append(rendered if rendered is not None else f"<p>{plain_html(blocks[index])}</p>")
+        self.replace_stream_tail(parts)
+        scroll_bar = self.chat_display.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+
+    def replace_stream_tail(self, parts):
+        """Replace everything after stream_tail with rendered blocks; returns the end."""
+        cursor = QTextCursor(self.stream_tail.document())
+        cursor.setPosition(self.stream_tail.position())
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        for index, part in enumerate(parts):
+            if index == 0 and self.stream_committed == 0:
+                # The reply's first block shares the avatar's line
+                cursor.insertFragment(QTextDocumentFragment.fromHtml(part))
+            else:
+                insert_blocks(cursor, part)
+            cursor.movePosition(QTextCursor.End)
+        return cursor.position()
+
+    def end_stream(self):
+        self.stream_timer.stop()
+        self.flush_stream(final=True)
+        self.stream_tail = None
+        self.stream_request = None
+        self.append_separator()
+        # Stored messages may have finished rendering while the reply streamed
+        self.render_timer.start()
+
+    def handle_rendered(self, key):
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    def apply_renders(self):
+        if self.stream_timer.isActive():
+            self.stream_dirty = True
+            return
+        if not self.pending_renders or self.current_conversation is None:
+            return
+        messages = self.current_conversation.messages
+        pending = [seq for seq in self.pending_renders if seq < len(messages)]
+        if all(self.renderer.message_html(messages[seq]["content"]) is not None for seq in pending):
+            self.refresh_chat_display()
 
     def handle_error(self, error_message):
+        if self.sender() is not self.stream_request:
+            self.statusBar().showMessage(f"Reply in another conversation failed: {error_message}", 5000)
+            return
+        self.end_stream()
+        # The document keeps a partial reply that is not in the conversation
+        self.chat_document_version = None
         QMessageBox.warning(
             self, "Error", f"An error occurred: {error_message}")
 
-    def display_message(self, sender, message):
+    def display_message(self, sender, message, anchor=None):
+        html = self.message_html(sender, message)
+        if anchor:
+            html = f'<a name="{anchor}"></a>' + html
+        self.chat_display.append(html)
+        self.append_separator()
+
+    def append_separator(self):
+        # A plain block, so a message ending in a list or code does not run on
+        cursor = QTextCursor(self.chat_display.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+
+    def stored_message_html(self, seq, message):
+        sender = "You" if message["role"] == "user" else "ChatGPT"
+        content = message["content"]
+        if sender == "ChatGPT":
+            rendered = self.renderer.message_html(content)
+            if rendered is None:
+                # Plain text until the worker pool has rendered the Markdown
+                self.pending_renders.add(seq)
+                rendered = plain_html(content)
+            content = rendered
+        return f'<a name="message-{seq}"></a>' + self.message_html(sender, content)
+
+    def message_html(self, sender, message):
         if sender == "ChatGPT":
-            icon_path = "chatgpt.png"
+            icon_path = self.avatar_url
             message_html = f"""
             <div
                 <div style="display: flex; align-items: center; justify-content: flex-start; margin-bottom: 10px;">
-                    <img src="{icon_path}" alt="ChatGPT" width="16" height="16" style="margin-right: 10px;">
+                    <img src="{icon_path}" alt="ChatGPT" width="{AVATAR_SIZE.width()}" height="{AVATAR_SIZE.height()}" style="margin-right: 10px;">
                     {message}
                 </div>
             </div>    
@@ -339,38 +1336,118 @@ class MainWindow(QMainWindow):
                     </div>
                 </div>
             """
-
-        self.chat_display.append(message_html)
-        self.chat_display.append("")
+        return message_html
 
     def clear_chat_display(self):
-        self.chat_display.clear()
+        # A fresh document rather than clear(): the old one may be in document_cache
+        self.first_rendered_seq = 0
+        self.chat_document_version = None
+        # Messages of this document still shown as plain text
+        self.pending_renders = set()
+        self.chat_document = QTextDocument()
+        self.chat_document.setDefaultFont(self.chat_display.font())
+        # Messages refer to the avatar by this URL instead of decoding chatgpt.png
+        self.avatar_url = self.icons.register(self.chat_document, "chatgpt.png", AVATAR_SIZE,
+                                              self.chat_display.devicePixelRatioF())
+        self.chat_display.setDocument(self.chat_document)
+
+    def stash_chat_document(self):
+        """Keep the displayed document for switching back to its conversation."""
+        conversation = self.current_conversation
+        if (conversation is None or self.stream_timer.isActive()
+                or self.chat_document_version != conversation.version):
+            return
+        state = (self.first_rendered_seq, self.chat_display.verticalScrollBar().value(), self.pending_renders)
+        self.document_cache.put(conversation.id, conversation.version, self.chat_document, state)
+
+    def restore_chat_document(self, conversation):
+        """Show a cached document of the conversation; False if there is none."""
+        cached = self.document_cache.get(conversation.id, conversation.version)
+        if cached is None:
+            return False
+        document, (first_rendered_seq, scroll_value, pending_renders) = cached
+        # Not loading older messages while the swap moves the scroll bar
+        self.first_rendered_seq = 0
+        self.chat_document = document
+        self.chat_display.setDocument(document)
+        self.chat_document_version = conversation.version
+        self.first_rendered_seq = first_rendered_seq
+        self.chat_display.verticalScrollBar().setValue(scroll_value)
+        self.pending_renders = pending_renders
+        if pending_renders:
+            self.render_timer.start()
+        return True
 
     def display_conversation(self):
-        for message in self.current_conversation.messages:
-            sender = "You" if message["role"] == "user" else "ChatGPT"
-            self.display_message(sender, message["content"])
-
-    def update_conversation_list(self):
-        self.conversation_list.clear()
-        for conversation in self.conversations:
-            item = QListWidgetItem(conversation.title or "New Chat")
-            self.conversation_list.addItem(item)
+        """Render the latest messages; older ones follow on scrolling up."""
+        self.render_messages(max(0, self.current_conversation.message_count() - MESSAGE_WINDOW))
+        scroll_bar = self.chat_display.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+        # Short messages may not fill the view, leaving nothing to scroll up with
+        while scroll_bar.maximum() <= LOAD_OLDER_MARGIN and self.first_rendered_seq > 0:
+            self.render_older_messages()
+
+    def render_messages(self, start):
+        messages = self.current_conversation.messages
+        for seq in range(start, len(messages)):
+            self.chat_display.append(self.stored_message_html(seq, messages[seq]))
+            self.append_separator()
+        self.first_rendered_seq = start
+        self.chat_document_version = self.current_conversation.version
+
+    def refresh_chat_display(self):
+        """Re-render the displayed messages, e.g. once their Markdown is ready."""
+        start = self.first_rendered_seq
+        scroll_bar = self.chat_display.verticalScrollBar()
+        distance_from_bottom = scroll_bar.maximum() - scroll_bar.value()
+        self.clear_chat_display()
+        self.render_messages(start)
+        scroll_bar.setValue(scroll_bar.maximum() - distance_from_bottom)
+
+    def handle_chat_scroll(self, value):
+        if value <= LOAD_OLDER_MARGIN and self.first_rendered_seq > 0 and self.current_conversation:
+            self.render_older_messages()
+
+    def render_older_messages(self):
+        """Prepend the previous page of messages, keeping the view where it was."""
+        messages = self.current_conversation.messages
+        start = max(0, self.first_rendered_seq - MESSAGE_PAGE)
+        html = "<p></p>".join(self.stored_message_html(seq, messages[seq])
+                              for seq in range(start, self.first_rendered_seq))
+        self.first_rendered_seq = start
+        scroll_bar = self.chat_display.verticalScrollBar()
+        distance_from_bottom = scroll_bar.maximum() - scroll_bar.value()
+        cursor = QTextCursor(self.chat_display.document())
+        cursor.movePosition(QTextCursor.Start)
+        cursor.insertBlock()
+        cursor.movePosition(QTextCursor.Start)
+        # The fragment's last block merges into the one inserted above
+        cursor.insertFragment(QTextDocumentFragment.fromHtml(html + "<p></p>"))
+        scroll_bar.setValue(scroll_bar.maximum() - distance_from_bottom)
+
+    def ensure_message_rendered(self, seq):
+        while seq < self.first_rendered_seq:
+            self.render_older_messages()
 
     def clear_conversations(self):
         reply = QMessageBox.question(self, "Clear Conversations",
                                      "Are you sure you want to clear all conversations?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.conversations.clear()
+            self.detach_stream()
+            self.requests.cancel_all()
+            for conversation in self.conversations:
+                self.conversation_cache.forget(conversation)
+            self.document_cache.clear()
+            self.conversation_model.clear()
+            self.store.clear()
             self.current_conversation = None
-            self.update_conversation_list()
             self.clear_chat_display()
             self.title_label.setText("ChatGPT")
-            self.save_conversations()
+            self.update_send_button()
 
     def show_context_menu(self, position):
-        if not self.conversation_list.itemAt(position):
+        if not self.conversation_list.indexAt(position).isValid():
             return
 
         context_menu = QMenu(self)
@@ -389,48 +1466,52 @@ class MainWindow(QMainWindow):
             self.delete_conversation()
 
     def rename_conversation(self):
-        current_item = self.conversation_list.currentItem()
-        if current_item:
-            index = self.conversation_list.row(current_item)
+        current_index = self.conversation_list.currentIndex()
+        if current_index.isValid():
+            index = self.conversation_row(current_index)
             conversation = self.conversations[index]
             new_title, ok = QMessageBox.getText(self, "Rename Conversation",
                                                 "Enter new title:", text=conversation.title)
             if ok and new_title:
                 conversation.title = new_title
-                current_item.setText(new_title)
+                self.conversation_model.conversation_changed(conversation)
+                self.save_conversation(conversation)
                 if self.current_conversation == conversation:
                     self.title_label.setText(new_title)
-                self.save_conversations()
 
     def delete_conversation(self):
-        current_item = self.conversation_list.currentItem()
-        if current_item:
+        current_index = self.conversation_list.currentIndex()
+        if current_index.isValid():
             reply = QMessageBox.question(self, "Delete Conversation",
                                          "Are you sure you want to delete this conversation?",
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                index = self.conversation_list.row(current_item)
-                del self.conversations[index]
-                self.conversation_list.takeItem(index)
-                if self.current_conversation == self.conversations[index]:
+                index = self.conversation_row(current_index)
+                conversation = self.conversation_model.remove(index)
+                self.requests.cancel(conversation)
+                self.store.delete(conversation.id)
+                self.conversation_cache.forget(conversation)
+                self.document_cache.forget(conversation.id)
+                if self.current_conversation == conversation:
+                    self.detach_stream()
                     self.current_conversation = None
                     self.clear_chat_display()
                     self.title_label.setText("ChatGPT")
-                self.save_conversations()
+                    self.update_send_button()
 
-    def save_conversations(self):
-        data = [conv.to_dict() for conv in self.conversations]
-        with open("conversations.json", "w") as f:
-            json.dump(data, f)
+    def save_conversation(self, conversation):
+        self.store.save(conversation.to_dict())
 
     def load_conversations(self):
-        try:
+        self.store = ConversationStore()
+        if self.store.is_empty() and os.path.exists("conversations.json"):
             with open("conversations.json", "r") as f:
                 data = json.load(f)
-                self.conversations = [Conversation.from_dict(
-                    conv_data) for conv_data in data]
-        except FileNotFoundError:
-            self.conversations = []
+            conversations = [Conversation.from_dict(conv_data, self.shared_client) for conv_data in data]
+            self.store.migrate_from_json([conv.to_dict() for conv in conversations], "conversations.json")
+        self.conversation_cache = ConversationCache(self.store, MAX_RESIDENT_CONVERSATIONS)
+        self.conversations = [Conversation.from_dict(conv_data, self.shared_client, self.conversation_cache)
+                              for conv_data in self.store.load_index()]
 
     def upload_document(self):
         file_dialog = QFileDialog()
@@ -441,20 +1522,115 @@ class MainWindow(QMainWindow):
             if self.file_path:
                 self.rag = True
                 self.display_message("📚", f'file uploaded {self.file_path}')
+                self.start_indexing(self.file_path)
+
+    def start_indexing(self, file_path):
+        self.cancel_indexing()
+        self.index_thread = IndexThread(self.get_retrieval_engine(), file_path, self)
+        self.index_thread.pages_parsed.connect(self.handle_pages_parsed)
+        self.index_thread.chunks_embedded.connect(self.handle_chunks_embedded)
+        self.index_thread.indexing_finished.connect(self.handle_indexing_finished)
+        self.index_thread.indexing_cancelled.connect(self.handle_indexing_cancelled)
+        self.index_thread.error_occurred.connect(self.handle_indexing_error)
+        self.index_progress.setRange(0, 0)
+        self.index_progress.show()
+        self.cancel_index_btn.show()
+        self.statusBar().showMessage("Indexing document...")
+        self.start_background_job(self.index_thread)
+
+    def get_retrieval_engine(self):
+        if self.retrieval_engine is None:
+            self.retrieval_engine = create_retrieval_engine(self.shared_client)
+            self.chatbot.retrieval_engine = self.retrieval_engine
+        return self.retrieval_engine
+
+    def cancel_indexing(self):
+        if self.index_thread is not None:
+            self.index_thread.cancel()
+            self.index_thread = None
+            self.hide_indexing_progress()
+
+    def hide_indexing_progress(self):
+        self.index_progress.hide()
+        self.cancel_index_btn.hide()
+
+    def handle_pages_parsed(self, done, total):
+        if self.sender() is not self.index_thread:
+            return
+        self.index_progress.setRange(0, total)
+        self.index_progress.setValue(done)
+        self.statusBar().showMessage(f"Parsing pages: {done}/{total}")
+
+    def handle_chunks_embedded(self, done, total):
+        if self.sender() is not self.index_thread:
+            return
+        self.index_progress.setRange(0, total)
+        self.index_progress.setValue(done)
+        self.statusBar().showMessage(f"Embedding chunks: {done}/{total}")
+
+    def handle_indexing_finished(self, file_path):
+        if self.sender() is not self.index_thread:
+            return
+        self.index_thread = None
+        self.hide_indexing_progress()
+        self.statusBar().showMessage(f"Indexed {os.path.basename(file_path)}", 5000)
+
+    def handle_indexing_cancelled(self, file_path):
+        self.statusBar().showMessage(f"Indexing of {os.path.basename(file_path)} cancelled", 5000)
+
+    def handle_indexing_error(self, error_message):
+        if self.sender() is self.index_thread:
+            self.index_thread = None
+            self.hide_indexing_progress()
+        QMessageBox.warning(
+            self, "Error", f"Indexing failed: {error_message}")
 
 
     def change_model(self):
         selected_model = self.model_dropdown.currentText()
         self.chatbot.model = selected_model
+        self.async_chatbot.model = selected_model
 
     def filter_conversations(self):
         search_text = self.search_bar.text().lower()
-        for i in range(self.conversation_list.count()):
-            item = self.conversation_list.item(i)
-            if search_text in item.text().lower():
-                item.setHidden(False)
-            else:
-                item.setHidden(True)
+        # Results of any search still running are stale from here on
+        self.search_generation += 1
+        if not search_text.strip():
+            self.conversation_proxy.set_matches(None)
+            self.show_search_results([])
+            return
+        titles = [(conversation.id, (conversation.title or "New Chat").lower())
+                  for conversation in self.conversations]
+        self.search_thread.search(self.search_generation, search_text, titles)
+
+    def handle_search_results(self, generation, matched_ids, hits):
+        if generation != self.search_generation:
+            return
+        self.conversation_proxy.set_matches(matched_ids)
+        self.show_search_results(hits)
+
+    def show_search_results(self, hits):
+        self.search_results.clear()
+        titles = {conversation.id: conversation.title or "New Chat" for conversation in self.conversations}
+        for hit in hits:
+            sender = "You" if hit["role"] == "user" else "ChatGPT"
+            item = QListWidgetItem(f"{titles.get(hit['conversation_id'], 'New Chat')} · {sender}: {hit['snippet']}")
+            item.setData(Qt.UserRole, (hit["conversation_id"], hit["seq"]))
+            self.search_results.addItem(item)
+        self.search_results.setVisible(bool(hits))
+
+    def open_search_result(self, item):
+        conversation_id, seq = item.data(Qt.UserRole)
+        row = self.conversation_model.row_of(conversation_id)
+        if row is None:
+            return
+        conversation = self.conversations[row]
+        if conversation is not self.current_conversation:
+            self.open_conversation(conversation)
+            source_index = self.conversation_model.index(row)
+            self.conversation_list.setCurrentIndex(self.conversation_proxy.mapFromSource(source_index))
+        self.ensure_message_rendered(seq)
+        self.chat_display.scrollToAnchor(f"message-{seq}")
 
 
 def main():
@@ -0,0 +1,175 @@
+"""Throughput and thread count with many conversations in flight, against the local stub server.
+
+Every conversation streams its chat turns one after the other, then names
+and summarizes itself and embeds its text through the EmbeddingScheduler,
+like the app does. Runs the same workload with a thread per request (the
+old ChatThread design), a bounded pool of worker threads and, as the app
+does, AsyncChatGPT on one event loop for chat turns, titles and summaries:
+
+    python benchmarks/bench_concurrency.py --conversations 50 --turns 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import Conversation
+from embedding_scheduler import EmbeddingScheduler
+from openai_client import EventLoopThread, SharedAsyncClient, SharedClient
+from responder import AsyncChatGPT, ChatGPT
+from stub_openai_server import StubOpenAIServer
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+POOL_WORKERS = 4
+
+
+class ThreadCounter:
+    """Peak number of client threads, sampled while a run is going."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="thread-counter", daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            # The stub server's own threads live in this process too
+            threads = [thread for thread in threading.enumerate()
+                       if thread is not self._thread and "process_request_thread" not in thread.name
+                       and "serve_forever" not in thread.name]
+            self.peak = max(self.peak, len(threads))
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def steps(number, turns):
+    """The requests of one conversation, in order: (kind, messages)."""
+    messages = [{"role": "user", "content": f"question {turn} of conversation {number}"} for turn in range(turns)]
+    return ([("chat", messages[:turn + 1]) for turn in range(turns)]
+            + [("title", messages), ("summary", messages),
+               ("embed", [message["content"] for message in messages])])
+
+
+def run_step(chatbot, embedder, kind, payload):
+    if kind == "chat":
+        return "".join(chatbot.stream_chat_completion(payload))
+    if kind in ("title", "summary"):
+        return chatbot.create_chat_completion(payload)
+    return embedder.embed_batch(payload)
+
+
+def thread_per_request(chatbot, embedder, conversations):
+    """Each request gets a new thread, which starts its conversation's next one."""
+    done = threading.Semaphore(0)
+
+    def run(queue):
+        kind, payload = queue.pop(0)
+        run_step(chatbot, embedder, kind, payload)
+        if queue:
+            threading.Thread(target=run, args=(queue,)).start()
+        else:
+            done.release()
+
+    for queue in conversations:
+        threading.Thread(target=run, args=(queue,)).start()
+    for _ in conversations:
+        done.acquire()
+
+
+def worker_pool(chatbot, embedder, conversations):
+    """A fixed pool of workers; a conversation's next request is queued when the last one is done."""
+    done = threading.Semaphore(0)
+    executor = ThreadPoolExecutor(max_workers=POOL_WORKERS)
+
+    def run(queue):
+        kind, payload = queue.pop(0)
+        run_step(chatbot, embedder, kind, payload)
+        if queue:
+            executor.submit(run, queue)
+        else:
+            done.release()
+
+    for queue in conversations:
+        executor.submit(run, queue)
+    for _ in conversations:
+        done.acquire()
+    executor.shutdown()
+
+
+def event_loop(chatbot, embedder, conversations):
+    """Every conversation is a task on the one event loop, named and summarized the way the app does it."""
+
+    async def converse(queue):
+        conversation = Conversation()
+        for kind, payload in queue:
+            if kind == "chat":
+                async for _ in chatbot.stream_chat_completion(payload):
+                    pass
+            elif kind == "title":
+                await Conversation.generate_titles(chatbot, [payload])
+            elif kind == "summary":
+                await conversation.summarize(chatbot, payload)
+            else:
+                # Indexing embeds on the EmbeddingScheduler's own threads
+                await asyncio.to_thread(embedder.embed_batch, payload)
+
+    async def converse_all():
+        await asyncio.gather(*(converse(queue) for queue in conversations))
+
+    chatbot.submit(converse_all()).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=2, help="streamed chat turns per conversation")
+    parser.add_argument("--latency", type=float, default=0.2, help="server time to first token (s)")
+    parser.add_argument("--tokens", type=int, default=30, help="tokens per streamed reply")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(latency=args.latency, requests_per_minute=1_000_000,
+                              reply_tokens=args.tokens, token_interval=args.token_interval).start()
+    shared_client = SharedClient(api_key="stub")
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    loop = EventLoopThread()
+    async_client = SharedAsyncClient(loop, api_key="stub")
+    embedder = EmbeddingScheduler(shared_client.get(), model=EMBEDDING_MODEL)
+    requests = args.conversations * (args.turns + 3)
+    print(f"{args.conversations} conversations, {requests} requests")
+
+    runs = [
+        ("thread per request", thread_per_request, ChatGPT(shared_client=shared_client)),
+        (f"pool of {POOL_WORKERS} workers", worker_pool, ChatGPT(shared_client=shared_client)),
+        ("asyncio, one event loop", event_loop, AsyncChatGPT(async_client)),
+    ]
+    for label, run, chatbot in runs:
+        conversations = [steps(number, args.turns) for number in range(args.conversations)]
+        with ThreadCounter() as threads:
+            started = time.perf_counter()
+            run(chatbot, embedder, conversations)
+            elapsed = time.perf_counter() - started
+        print(f"{label:<26} {requests / elapsed:>8.1f} requests/s  {elapsed:>6.2f} s  "
+              f"peak threads {threads.peak}")
+
+    shared_client.close()
+    async_client.close()
+    loop.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Embedding throughput (chunks/sec) against the local stub server.
+
+Compares a sequential, one-batch-at-a-time build with EmbeddingScheduler
+at several batch sizes and worker counts:
+
+    python benchmarks/bench_embeddings.py --chunks 4000 --latency 0.1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI
+
+from embedding_scheduler import EmbeddingScheduler
+from stub_openai_server import StubOpenAIServer
+
+
+def run(label, client, texts, batch_size, max_workers):
+    scheduler = EmbeddingScheduler(client, batch_size=batch_size, max_workers=max_workers)
+    started = time.perf_counter()
+    vectors = scheduler.embed(texts)
+    elapsed = time.perf_counter() - started
+    assert len(vectors) == len(texts)
+    print(f"{label:<28} {len(texts) / elapsed:>10.1f} chunks/s  "
+          f"{elapsed:>7.2f} s  retries={scheduler.retries}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency per request (s)")
+    parser.add_argument("--rpm", type=int, default=3000, help="server requests-per-minute limit")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(latency=args.latency, requests_per_minute=args.rpm).start()
+    client = OpenAI(api_key="stub", base_url=server.base_url)
+    texts = [f"chunk {i} " + "lorem ipsum " * 100 for i in range(args.chunks)]
+
+    run("sequential, batch=16", client, texts, batch_size=16, max_workers=1)
+    for batch_size, max_workers in [(16, 4), (64, 1), (64, 4), (64, 8), (256, 8)]:
+        run(f"batch={batch_size}, workers={max_workers}", client, texts, batch_size, max_workers)
+    print(f"server rejected {server.rejected} requests with 429")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Full-text search latency over a synthetic message history.
+
+    python benchmarks/bench_search.py --messages 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ConversationStore
+
+WORDS = ("python sort dictionary list error install package function class async thread "
+         "query index database table column vector embedding model token request response "
+         "window layout widget signal slot timer stream render markdown code block file path").split()
+QUERIES = ["sort dict", "embedding", "thread sig", "database index column", "render markdown code",
+           "p", "qu", "token window", "zebra", "install package error"]
+
+
+def message(rng):
+    # Rarer words further down the list, roughly like natural text
+    words = rng.choices(WORDS, weights=[1 / (rank + 1) for rank in range(len(WORDS))], k=rng.randint(8, 80))
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--per-conversation", type=int, default=50)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as root:
+        store = ConversationStore(Path(root) / "conversations.db")
+        started = time.perf_counter()
+        for number in range(args.messages // args.per_conversation):
+            store.save({
+                "id": f"conversation-{number}",
+                "title": f"Chat {number}",
+                "summary": None,
+                "created_at": datetime.now().isoformat(),
+                "messages": [{"role": "user" if seq % 2 == 0 else "assistant", "content": message(rng)}
+                             for seq in range(args.per_conversation)],
+            })
+        print(f"indexed {args.messages} messages in {time.perf_counter() - started:.1f} s")
+
+        timings = []
+        for query in QUERIES:
+            started = time.perf_counter()
+            hits = store.search(query)
+            elapsed = (time.perf_counter() - started) * 1000
+            timings.append(elapsed)
+            print(f"{query!r:<26} {len(hits):>3} hits  {elapsed:>7.1f} ms")
+        print(f"median {statistics.median(timings):.1f} ms  max {max(timings):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
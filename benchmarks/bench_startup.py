@@ -0,0 +1,57 @@
+"""Time to restore saved conversations: one OpenAI client each vs one shared client.
+
+    python benchmarks/bench_startup.py --conversations 2000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from openai import OpenAI
+
+from app import Conversation
+from openai_client import SharedClient
+
+
+def saved_conversations(count):
+    return [{
+        "title": f"Chat {i}",
+        "messages": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello!"}],
+        "created_at": datetime.now().isoformat(),
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    args = parser.parse_args()
+    data = saved_conversations(args.conversations)
+
+    started = time.perf_counter()
+    shared_client = SharedClient("benchmark")
+    conversations = [Conversation.from_dict(conv_data, shared_client) for conv_data in data]
+    lazy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    shared_client.get()
+    first_use = time.perf_counter() - started
+
+    # What load_conversations used to do: a fresh client and connection pool per conversation
+    started = time.perf_counter()
+    clients = [OpenAI(api_key="benchmark") for _ in data]
+    conversations = [Conversation.from_dict(conv_data) for conv_data in data]
+    per_conversation = time.perf_counter() - started
+    del clients, conversations
+
+    print(f"{args.conversations} conversations")
+    print(f"client per conversation  {per_conversation * 1000:>9.1f} ms")
+    print(f"shared, lazy client      {lazy * 1000:>9.1f} ms  (+{first_use * 1000:.1f} ms on first request)")
+    print(f"speedup                  {per_conversation / max(lazy + first_use, 1e-9):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
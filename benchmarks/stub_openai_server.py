@@ -0,0 +1,136 @@
+"""Minimal local stand-in for the OpenAI API, used by the benchmarks.
+
+Serves embeddings and chat completions, streamed or not. Responses carry
+``x-ratelimit-*`` headers and the server answers 429 once the configured
+requests-per-minute budget is spent, like the real API.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.05, dimensions=256, requests_per_minute=600,
+                 reply_tokens=20, token_interval=0.01):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.dimensions = dimensions
+        # Chat replies: this many tokens, streamed this far apart
+        self.reply_tokens = reply_tokens
+        self.token_interval = token_interval
+        self.requests_per_minute = requests_per_minute
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def take_request(self):
+        """Count a request against the per-minute window; returns (allowed, remaining, reset)."""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_requests = 0
+            reset = 60 - (now - self.window_start)
+            if self.window_requests >= self.requests_per_minute:
+                self.rejected += 1
+                return False, 0, reset
+            self.window_requests += 1
+            return True, self.requests_per_minute - self.window_requests, reset
+
+
+def fake_embedding(text, dimensions):
+    rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        allowed, remaining, reset = self.server.take_request()
+        headers = {
+            "x-ratelimit-limit-requests": str(self.server.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after"] = f"{reset:.3f}"
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+            return
+
+        time.sleep(self.server.latency)
+        if self.path.endswith("/embeddings"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [{"object": "embedding", "index": index,
+                     "embedding": fake_embedding(str(text), self.server.dimensions)}
+                    for index, text in enumerate(inputs)]
+            self.send_json(200, {"object": "list", "data": data, "model": body["model"],
+                                 "usage": {"prompt_tokens": 0, "total_tokens": 0}}, headers)
+        elif self.path.endswith("/chat/completions"):
+            tokens = [f"token{index} " for index in range(self.server.reply_tokens)]
+            if body.get("stream"):
+                self.send_stream(body["model"], tokens, headers)
+            else:
+                time.sleep(self.server.token_interval * len(tokens))
+                self.send_json(200, {
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                }, headers)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}}, headers)
+
+    def send_stream(self, model, tokens, headers):
+        """Server-sent events, one chunk per token, like ``stream=True``."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for token in tokens:
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": {"content": token},
+                                                      "finish_reason": None}]}
+                self.send_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(self.server.token_interval)
+            self.send_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            pass
+
+    def send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
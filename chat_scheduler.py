@@ -0,0 +1,131 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from context_window import count_tokens
+from rate_limiter import RETRYABLE_ERRORS, ModelBudget
+
+# Reply tokens counted against the token budget when max_tokens is not given
+EXPECTED_COMPLETION_TOKENS = 500
+
+# Called before each retry with the attempt number, the delay and the error
+RetryCallback = Callable[[int, float, Exception], None]
+
+
+class RequestCancelled(Exception):
+    """Raised when a request is cancelled while waiting for rate-limit budget."""
+
+
+class ChatScheduler:
+    """Sends chat completions within per-model rate limits, retrying transient failures.
+
+    Every model has a request and a token budget, re-synced from the
+    ``x-ratelimit-*`` headers of each response. Requests wait for budget
+    instead of running into 429s. A retryable failure (429, 5xx, dropped
+    connection, timeout) holds back all requests to that model for
+    ``retry-after`` or an exponential backoff with jitter, then the request
+    is retried, up to ``max_retries`` times. A burst is spread out this way
+    instead of failing. Streamed requests are only retried while opening;
+    once deltas arrive, a failure is the caller's.
+
+    One scheduler is shared by the sync and async clients, so both draw on
+    the same budgets.
+    """
+
+    def __init__(self, max_retries: int = 6, requests_per_minute: float = 500,
+                 tokens_per_minute: float = 200_000):
+        self.max_retries = max_retries
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._budgets: Dict[str, ModelBudget] = {}
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.completed = 0
+        self.retries = 0
+        self.failures = 0
+
+    def budget(self, model: str) -> ModelBudget:
+        with self._lock:
+            if model not in self._budgets:
+                self._budgets[model] = ModelBudget(self.requests_per_minute, self.tokens_per_minute)
+            return self._budgets[model]
+
+    def create(self, client, on_retry: Optional[RetryCallback] = None,
+               should_stop: Callable[[], bool] = None, **params):
+        """``client.chat.completions.create(**params)``, scheduled and retried.
+
+        Raises RequestCancelled if ``should_stop`` fires while waiting.
+        """
+        budget = self.budget(params["model"])
+        cost = estimate_request_tokens(params)
+        client = client.with_options(max_retries=0)
+        for attempt in range(self.max_retries + 1):
+            with self._waiting():
+                if not budget.acquire(cost, should_stop):
+                    raise RequestCancelled("Request cancelled")
+            try:
+                raw = client.chat.completions.with_raw_response.create(**params)
+            except RETRYABLE_ERRORS as e:
+                self._back_off(budget, e, attempt, on_retry)
+                continue
+            return self._parse(budget, raw)
+
+    async def create_async(self, client, on_retry: Optional[RetryCallback] = None, **params):
+        """The AsyncOpenAI counterpart of ``create``; cancel the task to give up."""
+        budget = self.budget(params["model"])
+        cost = estimate_request_tokens(params)
+        client = client.with_options(max_retries=0)
+        for attempt in range(self.max_retries + 1):
+            with self._waiting():
+                await budget.acquire_async(cost)
+            try:
+                raw = await client.chat.completions.with_raw_response.create(**params)
+            except RETRYABLE_ERRORS as e:
+                self._back_off(budget, e, attempt, on_retry)
+                continue
+            return self._parse(budget, raw)
+
+    def _back_off(self, budget: ModelBudget, error: Exception, attempt: int,
+                  on_retry: Optional[RetryCallback]):
+        """Count the failure and back off, or re-raise ``error`` when out of attempts."""
+        try:
+            delay = budget.back_off(error, attempt, self.max_retries)
+        except RETRYABLE_ERRORS:
+            with self._lock:
+                self.failures += 1
+            raise
+        with self._lock:
+            self.retries += 1
+        if on_retry is not None:
+            on_retry(attempt + 1, delay, error)
+
+    def _parse(self, budget: ModelBudget, raw):
+        budget.update_from_headers(raw.headers)
+        with self._lock:
+            self.completed += 1
+        return raw.parse()
+
+    @contextmanager
+    def _waiting(self):
+        with self._lock:
+            self.waiting += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+
+def estimate_request_tokens(params: Dict) -> int:
+    """Tokens a request counts against the budget: the prompt plus the expected reply."""
+    prompt = count_tokens(params["model"], params["messages"])
+    return prompt + (params.get("max_tokens") or EXPECTED_COMPLETION_TOKENS)
@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+
+# SQLite limits the number of host parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkStore:
+    """Content-addressed store of chunk embeddings.
+
+    Each distinct chunk text is embedded once per model, whichever file it
+    came from, so re-indexing an edited file only embeds the chunks that
+    actually changed. Every index links the chunks it was built from, and
+    ``unlink`` drops the vectors no remaining index uses.
+    """
+
+    def __init__(self, model: str, path: Path = Path("embeddings") / "chunks.sqlite3"):
+        self.model = model
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS refs ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, file_hash TEXT NOT NULL,"
+            " PRIMARY KEY (model, hash, file_hash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS refs_file_hash ON refs (file_hash)")
+        self._db.commit()
+
+    def get_many(self, texts: List[str]) -> Dict[str, List[float]]:
+        """Return the stored vectors for whichever of ``texts`` are known."""
+        by_hash = {chunk_hash(text): text for text in texts}
+        hashes = list(by_hash)
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM chunks WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model, *batch],
+                )
+                for digest, vector in rows:
+                    found[by_hash[digest]] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        rows = [(self.model, chunk_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO chunks (model, hash, vector) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def link(self, file_hash: str, texts: List[str]):
+        """Record that the index of ``file_hash`` was built from ``texts``."""
+        rows = [(self.model, digest, file_hash) for digest in {chunk_hash(text) for text in texts}]
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO refs (model, hash, file_hash) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def linked_indexes(self) -> Set[str]:
+        with self._lock:
+            return {file_hash for file_hash, in self._db.execute("SELECT DISTINCT file_hash FROM refs")}
+
+    def freed_bytes(self, file_hashes: List[str]) -> int:
+        """Bytes of the vectors, of any model, that only the indexes in ``file_hashes`` use."""
+        if not file_hashes:
+            return 0
+        marks = ",".join("?" * len(file_hashes))
+        with self._lock:
+            freed, = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(chunks.vector)), 0) FROM"
+                f" (SELECT DISTINCT model, hash FROM refs WHERE file_hash IN ({marks})) AS dropped"
+                " JOIN chunks ON chunks.model = dropped.model AND chunks.hash = dropped.hash"
+                " WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.model = dropped.model"
+                f" AND refs.hash = dropped.hash AND refs.file_hash NOT IN ({marks}))",
+                [*file_hashes, *file_hashes],
+            ).fetchone()
+        return freed
+
+    def unlink(self, file_hashes: Iterable[str]) -> int:
+        """Forget the indexes of ``file_hashes`` and drop the vectors no index uses; returns how many."""
+        with self._lock:
+            self._db.executemany("DELETE FROM refs WHERE file_hash = ?", [(file_hash,) for file_hash in file_hashes])
+            removed = self._db.execute(
+                "DELETE FROM chunks WHERE NOT EXISTS"
+                " (SELECT 1 FROM refs WHERE refs.model = chunks.model AND refs.hash = chunks.hash)"
+            ).rowcount
+            self._db.commit()
+            if removed:
+                # Hand the freed pages back so the file counts less against the cache budget
+                self._db.execute("VACUUM")
+                self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM chunks WHERE model = ?",
+                (self.model,),
+            ).fetchone()
+        return {"chunks": count, "bytes": size}
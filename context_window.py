@@ -0,0 +1,110 @@
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import tiktoken
+
+# Context length per model, in tokens
+MODEL_CONTEXT_LIMITS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_LIMIT = 8192
+
+# Tokens kept free for the reply
+RESPONSE_RESERVE = 4096
+
+# Framing the API adds around every message, and once to prime the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REQUEST = 3
+
+STRATEGIES = ("sliding_window", "none")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Local tokenizer for a model; None when tiktoken cannot load one."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(model: str, text: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Offline without cached BPE files: ~4 characters per token
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(model: str, message: Dict) -> int:
+    return TOKENS_PER_MESSAGE + count_text_tokens(model, message["content"])
+
+
+def count_tokens(model: str, messages: List[Dict]) -> int:
+    return TOKENS_PER_REQUEST + sum(count_message_tokens(model, message) for message in messages)
+
+
+class ContextWindow:
+    """Fits outgoing messages into a model's token budget.
+
+    With the ``sliding_window`` strategy, messages are given up in this order
+    until the request fits:
+
+    1. retrieved context of older turns (a message carrying ``query`` is
+       reduced back to that query), oldest first;
+    2. whole messages, oldest first, except system and ``pinned`` messages;
+    3. retrieved context of the latest turn.
+
+    The latest message itself is always sent. Token counts come from a
+    local tokenizer and are cached per message text.
+    """
+
+    def __init__(self, strategy: str = "sliding_window", response_reserve: int = RESPONSE_RESERVE):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown context strategy: {strategy}")
+        self.strategy = strategy
+        self.response_reserve = response_reserve
+
+    def budget(self, model: str) -> int:
+        return MODEL_CONTEXT_LIMITS.get(model, DEFAULT_CONTEXT_LIMIT) - self.response_reserve
+
+    def fit(self, messages: List[Dict], model: str) -> Tuple[List[Dict], int]:
+        """Return the messages to send and their token count."""
+        messages = list(messages)
+        budget = self.budget(model)
+        total = count_tokens(model, messages)
+        if self.strategy == "none" or total <= budget:
+            return messages, total
+
+        def without_context(index):
+            nonlocal total
+            message = messages[index]
+            reduced = {"role": message["role"], "content": message["query"]}
+            total += count_message_tokens(model, reduced) - count_message_tokens(model, message)
+            messages[index] = reduced
+
+        for index, message in enumerate(messages[:-1]):
+            if total <= budget:
+                break
+            if "query" in message:
+                without_context(index)
+
+        index = 0
+        while total > budget and index < len(messages) - 1:
+            message = messages[index]
+            if message["role"] == "system" or message.get("pinned"):
+                index += 1
+                continue
+            total -= count_message_tokens(model, message)
+            del messages[index]
+
+        if total > budget and "query" in messages[-1]:
+            without_context(len(messages) - 1)
+
+        return messages, total
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from PySide6.QtGui import QTextDocument
+
+# Rough per-block cost of a laid out QTextDocument on top of its text
+BLOCK_OVERHEAD = 256
+
+
+def estimate_document_size(document: QTextDocument) -> int:
+    """Approximate resident bytes of a rendered document: UTF-16 text plus blocks."""
+    return document.characterCount() * 2 + document.blockCount() * BLOCK_OVERHEAD
+
+
+class DocumentCache:
+    """Rendered chat documents of recently viewed conversations.
+
+    Entries are keyed by conversation id and stored with the conversation
+    version they show, so a document is only reused while it is still up
+    to date. Least recently used documents are dropped once the estimated
+    total goes over ``max_bytes``. Each entry also carries whatever view
+    state the caller needs to restore (e.g. scroll position).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, Tuple[int, QTextDocument, object, int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, conversation_id: str, version: int) -> Optional[Tuple[QTextDocument, object]]:
+        """Return ``(document, state)`` if a document of this version is cached."""
+        entry = self._documents.get(conversation_id)
+        if entry is None or entry[0] != version:
+            if entry is not None:
+                del self._documents[conversation_id]
+            self.misses += 1
+            return None
+        self._documents.move_to_end(conversation_id)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, conversation_id: str, version: int, document: QTextDocument, state=None):
+        self._documents[conversation_id] = (version, document, state, estimate_document_size(document))
+        self._documents.move_to_end(conversation_id)
+        self._evict()
+
+    def forget(self, conversation_id: str):
+        self._documents.pop(conversation_id, None)
+
+    def clear(self):
+        self._documents.clear()
+
+    def _evict(self):
+        """Drop least recently used documents until under the memory cap."""
+        while len(self._documents) > 1 and self.memory_usage() > self.max_bytes:
+            self._documents.popitem(last=False)
+            self.evictions += 1
+
+    def memory_usage(self) -> int:
+        return sum(entry[3] for entry in self._documents.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self._documents),
+            "bytes": self.memory_usage(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
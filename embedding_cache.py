@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import faiss
+
+from chunk_store import ChunkStore
+
+DEFAULT_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# Access times are only written back when they are at least this stale
+TOUCH_INTERVAL = 60
+
+
+def count_vectors(index_dir: Path) -> Optional[int]:
+    try:
+        return faiss.read_index(str(index_dir / "index.faiss")).ntotal
+    except Exception:
+        return None
+
+
+def path_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class EmbeddingCache:
+    """Disk cache of built indexes under ``embeddings/`` with a byte budget.
+
+    ``manifest.json`` records, per file hash, the source path, size on disk,
+    chunk count, build time and last access. The budget also covers the
+    chunk store and the checkpoints of unfinished builds. When the cache
+    goes over ``max_bytes`` the least recently accessed indexes are removed,
+    along with chunk vectors no other index uses.
+    """
+
+    def __init__(self, root: Path = Path("embeddings"), max_bytes: int = DEFAULT_MAX_BYTES,
+                 chunk_store: Optional[ChunkStore] = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.chunk_store = chunk_store
+        self.manifest_path = self.root / "manifest.json"
+        self._lock = threading.Lock()
+        self.evictions = 0
+        if self.manifest_path.exists():
+            self.entries: Dict[str, dict] = self._load_manifest()
+        else:
+            # First run with a manifest: take over indexes built before it
+            self.entries = {}
+            self.compact()
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self):
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(self.entries, indent=2), encoding="utf-8")
+        os.replace(temp_path, self.manifest_path)
+
+    def index_path(self, file_hash: str) -> Path:
+        return self.root / f"{file_hash}.faiss"
+
+    def pages_path(self, file_hash: str) -> Path:
+        return self.root / f"{file_hash}.pages.json"
+
+    def checkpoint_path(self, file_hash: str) -> Path:
+        return self.root / f"{file_hash}.partial.jsonl"
+
+    def entry_size(self, file_hash: str) -> int:
+        return path_size(self.index_path(file_hash)) + path_size(self.pages_path(file_hash))
+
+    def record(self, file_hash: str, source: str, chunks: int, build_seconds: float):
+        """Register a freshly built index, then evict others if over budget."""
+        with self._lock:
+            self.entries[file_hash] = {
+                "source": str(Path(source).resolve()),
+                "size": self.entry_size(file_hash),
+                "chunks": chunks,
+                "built_at": datetime.now().isoformat(),
+                "build_seconds": round(build_seconds, 3),
+                "last_access": time.time(),
+            }
+            evicted = self._evict(protect=file_hash)
+            self._save_manifest()
+        self._release_chunks(evicted)
+
+    def touch(self, file_hash: str):
+        """Mark an index as used so it is evicted last."""
+        with self._lock:
+            entry = self.entries.get(file_hash)
+            now = time.time()
+            if entry is None or now - entry["last_access"] < TOUCH_INTERVAL:
+                return
+            entry["last_access"] = now
+            self._save_manifest()
+
+    def total_size(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values()) + self.shared_size()
+
+    def shared_size(self) -> int:
+        """Bytes not owned by any one index: the chunk store and build checkpoints."""
+        # The chunk store's WAL is left out: it is checkpointed back into the database
+        paths = [self.root / "chunks.sqlite3", *self.root.glob("*.partial.jsonl")]
+        return sum(path_size(path) for path in paths)
+
+    def _evict(self, protect: str = None) -> List[str]:
+        """Remove least recently used indexes until the cache fits its budget.
+
+        Their chunk vectors count as freed as soon as no remaining index
+        uses them; the caller deletes them with ``_release_chunks`` once
+        the lock is released.
+        """
+        evicted = []
+        indexes_size = sum(entry["size"] for entry in self.entries.values())
+        shared_size = self.shared_size()
+        freed = 0
+        by_age = sorted(self.entries, key=lambda file_hash: self.entries[file_hash]["last_access"])
+        for file_hash in by_age:
+            if indexes_size + shared_size - freed <= self.max_bytes:
+                break
+            if file_hash == protect:
+                continue
+            indexes_size -= self.entries[file_hash]["size"]
+            self._remove(file_hash)
+            evicted.append(file_hash)
+            if self.chunk_store is not None:
+                freed = self.chunk_store.freed_bytes(evicted)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _release_chunks(self, file_hashes: List[str]) -> int:
+        """Drop the chunk vectors only these indexes used, in one pass."""
+        if self.chunk_store is None or not file_hashes:
+            return 0
+        return self.chunk_store.unlink(file_hashes)
+
+    def _remove(self, file_hash: str):
+        shutil.rmtree(self.index_path(file_hash), ignore_errors=True)
+        self.pages_path(file_hash).unlink(missing_ok=True)
+        self.entries.pop(file_hash, None)
+
+    def compact(self) -> Dict[str, int]:
+        """Reconcile the manifest with the directory and evict down to budget.
+
+        Indexes on disk without a manifest entry (built before the manifest
+        existed) are adopted with their modification time as last access;
+        entries whose files are gone are dropped, as are page caches,
+        checkpoints and chunk vectors that no longer belong to anything.
+        """
+        with self._lock:
+            adopted = dropped = orphans = 0
+            for index_dir in self.root.glob("*.faiss"):
+                file_hash = index_dir.name[:-len(".faiss")]
+                if file_hash not in self.entries:
+                    self.entries[file_hash] = {
+                        "source": None,
+                        "size": self.entry_size(file_hash),
+                        "chunks": count_vectors(index_dir),
+                        "built_at": datetime.fromtimestamp(index_dir.stat().st_mtime).isoformat(),
+                        "build_seconds": None,
+                        "last_access": index_dir.stat().st_mtime,
+                    }
+                    adopted += 1
+            for file_hash in list(self.entries):
+                if not self.index_path(file_hash).exists():
+                    self._remove(file_hash)
+                    dropped += 1
+                else:
+                    self.entries[file_hash]["size"] = self.entry_size(file_hash)
+            for path in self.root.glob("*.partial.jsonl"):
+                # The build this checkpoint belonged to has finished
+                if path.name.split(".", 1)[0] in self.entries:
+                    path.unlink()
+                    orphans += 1
+            for path in self.root.glob("*.pages.json"):
+                file_hash = path.name.split(".", 1)[0]
+                # Page text of an interrupted build is kept so it can resume
+                if file_hash not in self.entries and not self.checkpoint_path(file_hash).exists():
+                    path.unlink()
+                    orphans += 1
+            evicted = self._evict()
+            self._save_manifest()
+            released = list(evicted)
+            if self.chunk_store is not None:
+                # An index is saved before it is linked, so one missing from disk is gone for good
+                released += [file_hash for file_hash in self.chunk_store.linked_indexes()
+                             if not self.index_path(file_hash).exists() and file_hash not in evicted]
+        # Also sweeps vectors no index ever linked
+        pruned = self.chunk_store.unlink(released) if self.chunk_store is not None else 0
+        return {"adopted": adopted, "dropped": dropped, "orphans_removed": orphans,
+                "chunks_pruned": pruned, "evicted": len(evicted)}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "indexes": len(self.entries),
+                "bytes": self.total_size(),
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compact the embeddings cache.")
+    parser.add_argument("command", choices=["stats", "list", "compact"])
+    parser.add_argument("--root", default="embeddings")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024))
+    args = parser.parse_args()
+
+    chunks_path = Path(args.root) / "chunks.sqlite3"
+    # Pruning is not tied to a model, so the store is opened without one
+    chunk_store = ChunkStore(None, chunks_path) if chunks_path.exists() else None
+    cache = EmbeddingCache(Path(args.root), args.max_mb * 1024 * 1024, chunk_store)
+    if args.command == "compact":
+        print(json.dumps(cache.compact(), indent=2))
+    elif args.command == "list":
+        by_recent = sorted(cache.entries.items(), key=lambda item: item[1]["last_access"], reverse=True)
+        for file_hash, entry in by_recent:
+            last_access = datetime.fromtimestamp(entry["last_access"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{file_hash}  {entry['size'] / 1024:>9.1f} KB  chunks={entry['chunks']}  "
+                  f"last={last_access}  {entry['source']}")
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
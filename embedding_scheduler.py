@@ -0,0 +1,138 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from rag import IndexingCancelled, ProgressCallback
+from rate_limiter import RETRYABLE_ERRORS, ModelBudget
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    """Rough token count (~4 characters per token), enough for rate limiting."""
+    return sum(len(text) // 4 + 1 for text in texts)
+
+
+class EmbeddingCheckpoint:
+    """Append-only JSON lines record of embedded batches.
+
+    The first line records the batch layout; a checkpoint written for a
+    different layout is discarded rather than resumed.
+    """
+
+    def __init__(self, path: Path, batch_size: int, total: int):
+        self.path = Path(path)
+        self.header = {"batch_size": batch_size, "total": total}
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[int, List[List[float]]]:
+        if not self.path.exists():
+            return {}
+        batches = {}
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        if not lines or json.loads(lines[0]) != self.header:
+            self.remove()
+            return {}
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn final write
+            batches[record["batch"]] = record["vectors"]
+        return batches
+
+    def append(self, batch: int, vectors: List[List[float]]):
+        with self._lock:
+            new_file = not self.path.exists()
+            with open(self.path, "a", encoding="utf-8") as f:
+                if new_file:
+                    f.write(json.dumps(self.header) + "\n")
+                f.write(json.dumps({"batch": batch, "vectors": vectors}) + "\n")
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+
+class EmbeddingScheduler:
+    """Embeds chunks in concurrent batches within the API's rate limits.
+
+    Request and token budgets are token buckets re-synced from the
+    ``x-ratelimit-*`` headers of every response. Retryable failures back off
+    exponentially (or for as long as ``retry-after`` says), and finished
+    batches are checkpointed so an interrupted build resumes where it stopped.
+    """
+
+    def __init__(self, client, model: str = "text-embedding-ada-002", batch_size: int = 64,
+                 max_workers: int = 4, max_retries: int = 6,
+                 requests_per_minute: float = 3000, tokens_per_minute: float = 1_000_000):
+        # Retries are handled here so they respect the shared buckets
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.budget = ModelBudget(requests_per_minute, tokens_per_minute)
+        self.retries = 0
+
+    def embed(self, texts: List[str], progress: ProgressCallback = None,
+              cancel: threading.Event = None, checkpoint_path: Optional[Path] = None) -> List[List[float]]:
+        """Embed ``texts`` and return their vectors in order."""
+        batches = [texts[start:start + self.batch_size]
+                   for start in range(0, len(texts), self.batch_size)]
+        checkpoint = None
+        results: Dict[int, List[List[float]]] = {}
+        if checkpoint_path is not None:
+            checkpoint = EmbeddingCheckpoint(checkpoint_path, self.batch_size, len(texts))
+            results = checkpoint.load()
+
+        embedded = sum(len(vectors) for vectors in results.values())
+        if progress and results:
+            progress("chunks", embedded, len(texts))
+
+        stop = threading.Event()
+
+        def should_stop():
+            return stop.is_set() or (cancel is not None and cancel.is_set())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self.embed_batch, batch, should_stop): index
+                for index, batch in enumerate(batches) if index not in results
+            }
+            try:
+                for future in as_completed(futures):
+                    index = futures[future]
+                    results[index] = future.result()
+                    if checkpoint is not None:
+                        checkpoint.append(index, results[index])
+                    embedded += len(results[index])
+                    if progress:
+                        progress("chunks", embedded, len(texts))
+            except BaseException:
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if checkpoint is not None:
+            checkpoint.remove()
+        return [vector for index in range(len(batches)) for vector in results[index]]
+
+    def embed_batch(self, batch: List[str], should_stop=None) -> List[List[float]]:
+        """Embed one batch, waiting for rate-limit budget and retrying transient errors."""
+        for attempt in range(self.max_retries + 1):
+            if should_stop is not None and should_stop():
+                raise IndexingCancelled("Indexing cancelled")
+            if not self.budget.acquire(estimate_tokens(batch), should_stop):
+                raise IndexingCancelled("Indexing cancelled")
+            try:
+                raw = self.client.embeddings.with_raw_response.create(model=self.model, input=batch)
+            except RETRYABLE_ERRORS as e:
+                self.budget.back_off(e, attempt, self.max_retries)
+                self.retries += 1
+                continue
+
+            self.budget.update_from_headers(raw.headers)
+            response = raw.parse()
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
@@ -0,0 +1,65 @@
+from pathlib import Path
+from typing import Dict, Tuple
+
+from PySide6.QtCore import QSize, Qt, QUrl
+from PySide6.QtGui import QGuiApplication, QIcon, QImage, QImageReader, QPixmap, QTextDocument
+
+# Variants always prepared besides the screens' own pixel ratios
+DEVICE_PIXEL_RATIOS = (1.0, 2.0)
+
+
+def device_pixel_ratios():
+    ratios = set(DEVICE_PIXEL_RATIOS)
+    for screen in QGuiApplication.screens():
+        ratios.add(screen.devicePixelRatio())
+    return sorted(ratios)
+
+
+class IconCache:
+    """Image assets decoded once and kept only as small pre-scaled copies.
+
+    The full-size source (chatgpt.png decodes to ~100 MB) is dropped as soon
+    as the variants for a size are made: one per device pixel ratio, so
+    HiDPI screens get sharp images without scaling at paint time.
+    """
+
+    def __init__(self, root: Path = Path(".")):
+        self.root = Path(root)
+        # (name, width, height) -> {device pixel ratio: image}
+        self._variants: Dict[Tuple[str, int, int], Dict[float, QImage]] = {}
+        self._icons: Dict[Tuple[str, int, int], QIcon] = {}
+
+    def variants(self, name: str, size: QSize) -> Dict[float, QImage]:
+        key = (name, size.width(), size.height())
+        if key not in self._variants:
+            source = QImageReader(str(self.root / name)).read()
+            if source.isNull():
+                raise Exception(f"Could not load image {name}")
+            variants = {}
+            for ratio in device_pixel_ratios():
+                image = source.scaled(size * ratio, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                image.setDevicePixelRatio(ratio)
+                variants[ratio] = image
+            self._variants[key] = variants
+        return self._variants[key]
+
+    def image(self, name: str, size: QSize, ratio: float = 1.0) -> QImage:
+        """The variant closest to ``ratio`` without going under it when possible."""
+        variants = self.variants(name, size)
+        larger = [candidate for candidate in variants if candidate >= ratio]
+        return variants[min(larger) if larger else max(variants)]
+
+    def icon(self, name: str, size: QSize) -> QIcon:
+        key = (name, size.width(), size.height())
+        if key not in self._icons:
+            icon = QIcon()
+            for image in self.variants(name, size).values():
+                icon.addPixmap(QPixmap.fromImage(image))
+            self._icons[key] = icon
+        return self._icons[key]
+
+    def register(self, document: QTextDocument, name: str, size: QSize, ratio: float = 1.0) -> str:
+        """Add the image to a document's resources and return its ``src`` URL."""
+        url = f"icon:{Path(name).stem}-{size.width()}x{size.height()}"
+        document.addResource(QTextDocument.ImageResource, QUrl(url), self.image(name, size, ratio))
+        return url
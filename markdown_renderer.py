@@ -0,0 +1,293 @@
+import hashlib
+import html
+import importlib.util
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QTextDocument
+
+# Code blocks are still set in a monospaced font without pygments, just not colored
+PYGMENTS_AVAILABLE = importlib.util.find_spec("pygments") is not None
+if PYGMENTS_AVAILABLE:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import TextLexer, get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+# Part of every cache key; bump it when the produced HTML changes
+RENDERER_VERSION = 1
+CODE_STYLE = "default"
+
+# Rendered blocks kept in memory in front of the on-disk cache
+MEMORY_CACHE_SIZE = 4096
+
+# HTML kept on disk; least recently used blocks are pruned down to
+# DISK_CACHE_PRUNE_TO of it once it grows past the cap
+DISK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DISK_CACHE_PRUNE_TO = 0.9
+PRUNE_BATCH_SIZE = 500
+
+FENCE = re.compile(r"^\s{0,3}(`{3,}|~{3,})\s*([\w+#.-]*)")
+BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S)
+
+
+def split_blocks(text: str) -> List[str]:
+    """Split Markdown into top-level blocks: fenced code blocks and runs of
+    lines between blank lines. Only the last block can still change while a
+    reply streams in."""
+    blocks, current, fence = [], [], None
+    for line in text.split("\n"):
+        match = FENCE.match(line)
+        if fence is None and match:
+            if current:
+                blocks.append("\n".join(current))
+            current, fence = [line], match.group(1)
+        elif fence is not None:
+            current.append(line)
+            if line.strip().startswith(fence) and line.strip().strip(fence[0]) == "":
+                blocks.append("\n".join(current))
+                current, fence = [], None
+        elif not line.strip():
+            if current:
+                blocks.append("\n".join(current))
+            current = []
+        else:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def plain_html(text: str) -> str:
+    return html.escape(text).replace("\n", "<br>")
+
+
+def render_code(block: str) -> str:
+    lines = block.split("\n")
+    match = FENCE.match(lines[0])
+    language = match.group(2)
+    closed = len(lines) > 1 and lines[-1].strip().startswith(match.group(1))
+    code = "\n".join(lines[1:-1] if closed else lines[1:])
+    if not PYGMENTS_AVAILABLE:
+        return f"<pre>{html.escape(code)}</pre>"
+    try:
+        lexer = get_lexer_by_name(language) if language else TextLexer()
+    except ClassNotFound:
+        lexer = TextLexer()
+    return highlight(code, lexer, HtmlFormatter(noclasses=True, style=CODE_STYLE))
+
+
+def render_block(block: str) -> str:
+    """HTML for one block, as understood by QTextDocument."""
+    if FENCE.match(block):
+        return render_code(block)
+    document = QTextDocument()
+    document.setMarkdown(block)
+    return BODY.search(document.toHtml()).group(1)
+
+
+def block_key(block: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}:{CODE_STYLE}:{block}".encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Rendered HTML by block content hash, in memory and in SQLite.
+
+    The SQLite cache is capped at ``max_bytes`` of HTML. Blocks are stamped
+    whenever they are read from or written to disk, and the least recently
+    used ones are pruned once it goes over, so blocks of deleted or long
+    unopened conversations age out.
+    """
+
+    def __init__(self, path: Path = Path("render_cache.db"), max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        # Keys only held in memory, e.g. drafts of a block still streaming
+        self._unsaved = set()
+        self.evictions = 0
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Losing the last few writes of a cache to a power cut is fine
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blocks (key TEXT PRIMARY KEY, html TEXT NOT NULL,"
+            " size INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(blocks)")]
+        if "last_used" not in columns:
+            # Caches written before the cap; their blocks count as least recently used
+            self._db.execute("ALTER TABLE blocks ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE blocks ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE blocks SET size = LENGTH(html)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS blocks_last_used ON blocks (last_used)")
+        self._db.commit()
+        self._disk_bytes, = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blocks").fetchone()
+        self._prune()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self._db.execute("SELECT html FROM blocks WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE blocks SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+                self._remember(key, row[0])
+            return row[0] if row else None
+
+    def put(self, key: str, rendered: str, persist: bool = True):
+        with self._lock:
+            self._remember(key, rendered)
+            if persist:
+                self._write(key, rendered)
+            else:
+                self._unsaved.add(key)
+
+    def save(self, key: str):
+        """Persist a block first put with ``persist=False``."""
+        with self._lock:
+            if key in self._unsaved and key in self._memory:
+                self._write(key, self._memory[key])
+
+    def _write(self, key: str, rendered: str):
+        replaced = self._db.execute("SELECT size FROM blocks WHERE key = ?", (key,)).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO blocks (key, html, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, rendered, len(rendered), time.time()),
+        )
+        self._db.commit()
+        self._disk_bytes += len(rendered) - (replaced[0] if replaced else 0)
+        self._unsaved.discard(key)
+        self._prune()
+
+    def _prune(self):
+        """Delete least recently used blocks from disk once over the byte cap."""
+        if self._disk_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * DISK_CACHE_PRUNE_TO
+        while self._disk_bytes > target:
+            rows = self._db.execute(
+                "SELECT key, size FROM blocks ORDER BY last_used LIMIT ?", (PRUNE_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            doomed = []
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                doomed.append((key,))
+                self._disk_bytes -= size
+            self._db.executemany("DELETE FROM blocks WHERE key = ?", doomed)
+            self.evictions += len(doomed)
+        self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, = self._db.execute("SELECT COUNT(*) FROM blocks").fetchone()
+            return {
+                "blocks": count,
+                "bytes": self._disk_bytes,
+                "max_bytes": self.max_bytes,
+                "in_memory": len(self._memory),
+                "evictions": self.evictions,
+            }
+
+    def _remember(self, key: str, rendered: str):
+        self._memory[key] = rendered
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_CACHE_SIZE:
+            evicted, _ = self._memory.popitem(last=False)
+            self._unsaved.discard(evicted)
+
+
+class MarkdownRenderer(QObject):
+    """Renders message Markdown to HTML fragments on a small worker pool.
+
+    Messages are rendered block by block and every block is cached by
+    content hash, so a finished message is rendered once, ever, and a
+    streaming reply only re-renders its trailing block. Lookups never
+    render: a miss queues the block and ``rendered`` fires when it is done.
+    """
+    rendered = Signal(str)
+
+    def __init__(self, cache: RenderCache = None, max_workers: int = 2, parent=None):
+        super().__init__(parent)
+        self.cache = cache or RenderCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        # key -> whether the result is to be persisted
+        self._pending = {}
+        # Only the newest draft of a streaming block is worth rendering
+        self._latest_draft = None
+        self._lock = threading.Lock()
+
+    def block_html(self, block: str, final: bool = True) -> Optional[str]:
+        """Cached HTML of a block, or None after queueing it for rendering.
+
+        Blocks that may still grow (``final=False``) are kept in memory only.
+        """
+        key = block_key(block)
+        rendered = self.cache.get(key)
+        if rendered is None:
+            self.request(key, block, final)
+        elif final:
+            self.cache.save(key)
+        return rendered
+
+    def render_now(self, block: str) -> str:
+        """HTML of a block, rendered on the calling thread on a cache miss."""
+        key = block_key(block)
+        rendered = self.cache.get(key)
+        if rendered is None:
+            rendered = self._render_block(block)
+            self.cache.put(key, rendered)
+        else:
+            self.cache.save(key)
+        return rendered
+
+    def message_html(self, text: str) -> Optional[str]:
+        """HTML of a whole message if all its blocks are rendered, else None."""
+        parts = [self.block_html(block) for block in split_blocks(text)]
+        if any(part is None for part in parts):
+            return None
+        return "".join(parts)
+
+    def request(self, key: str, block: str, final: bool = True):
+        with self._lock:
+            if not final:
+                self._latest_draft = key
+            if key in self._pending:
+                self._pending[key] = self._pending[key] or final
+                return
+            self._pending[key] = final
+        self._executor.submit(self._render, key, block)
+
+    def _render(self, key: str, block: str):
+        with self._lock:
+            if not self._pending[key] and key != self._latest_draft:
+                # A newer draft of this block has been requested since
+                del self._pending[key]
+                return
+        rendered = self._render_block(block)
+        with self._lock:
+            final = self._pending.pop(key)
+        self.cache.put(key, rendered, persist=final)
+        self.rendered.emit(key)
+
+    def _render_block(self, block: str) -> str:
+        try:
+            return render_block(block)
+        except Exception:
+            return f"<p>{plain_html(block)}</p>"
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
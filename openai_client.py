@@ -0,0 +1,152 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from concurrent.futures import Future
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from chat_scheduler import ChatScheduler
+
+# HTTP/2 multiplexes requests over one connection but needs the optional h2 package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(600.0, connect=10.0)
+
+
+class SharedClient:
+    """One OpenAI client, and so one keep-alive connection pool, for the whole app.
+
+    Nothing is created until the first request needs it; ``reset`` drops the
+    pool, e.g. after the API key changes. Chat completions go through
+    ``scheduler``, which holds the rate-limit budgets of the key.
+    """
+
+    def __init__(self, api_key=None, scheduler: ChatScheduler = None):
+        self.api_key = api_key
+        self.scheduler = scheduler or ChatScheduler()
+        self._client = None
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def get(self) -> OpenAI:
+        with self._lock:
+            if self._client is None:
+                self.api_key = self.api_key or os.getenv("OPENAI_API_KEY")
+                self._http_client = httpx.Client(http2=HTTP2_AVAILABLE, limits=http_limits(),
+                                                 timeout=http_timeout())
+                self._client = OpenAI(api_key=self.api_key, http_client=self._http_client)
+            return self._client
+
+    def get_http_client(self) -> httpx.Client:
+        self.get()
+        return self._http_client
+
+    def reset(self, api_key=None):
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._client = None
+            self._http_client = None
+            self.api_key = api_key
+
+    def close(self):
+        self.reset(self.api_key)
+
+
+class EventLoopThread:
+    """One asyncio event loop, running on a daemon thread for the app's lifetime.
+
+    The loop is started by the first ``submit``; coroutines from any thread
+    run on it and report back through the returned future.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="asyncio", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(2)
+            self._loop = None
+            self._thread = None
+
+
+class SharedAsyncClient:
+    """The ``AsyncOpenAI`` counterpart of SharedClient.
+
+    Every request made through it runs on ``event_loop`` and shares one
+    connection pool, however many are in flight at once. Pass the sync
+    client's ``scheduler`` to share its rate-limit budgets.
+    """
+
+    def __init__(self, event_loop: EventLoopThread, api_key=None, scheduler: ChatScheduler = None):
+        self.event_loop = event_loop
+        self.api_key = api_key
+        self.scheduler = scheduler or ChatScheduler()
+        self._client = None
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def get(self) -> AsyncOpenAI:
+        with self._lock:
+            if self._client is None:
+                self.api_key = self.api_key or os.getenv("OPENAI_API_KEY")
+                self._http_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=http_limits(),
+                                                      timeout=http_timeout())
+                self._client = AsyncOpenAI(api_key=self.api_key, http_client=self._http_client)
+            return self._client
+
+    def submit(self, coroutine) -> Future:
+        return self.event_loop.submit(coroutine)
+
+    def reset(self, api_key=None) -> Future:
+        """Drop the client; returns the future of closing its connections, if any."""
+        with self._lock:
+            closing = None
+            if self._http_client is not None:
+                # Closed on the loop that owns its connections
+                closing = self.event_loop.submit(self._http_client.aclose())
+            self._client = None
+            self._http_client = None
+            self.api_key = api_key
+            return closing
+
+    def close(self, timeout=2.0):
+        closing = self.reset(self.api_key)
+        if closing is not None:
+            closing.result(timeout)
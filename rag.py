@@ -1,13 +1,44 @@
 import os
 from pathlib import Path
 import hashlib
-from typing import List
+import json
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
 from langchain.embeddings.base import Embeddings
+import fitz  # PyMuPDF
+
+from embedding_cache import EmbeddingCache
+
+# progress(stage, done, total) where stage is "pages" or "chunks"
+ProgressCallback = Callable[[str, int, int], None]
+
+EMBEDDING_BATCH_SIZE = 64
+
+# Chunks close at content-defined boundaries between MIN_CHUNK_SIZE and
+# CHUNK_SIZE characters, so an edit only reshapes the chunks around it.
+CHUNK_SIZE = 1500
+MIN_CHUNK_SIZE = 500
+BOUNDARY_MODULUS = 4
+PIECE_BOUNDARY = re.compile(r'(?<=\.\n)|(?<=\n\n)')
+
+
+class IndexingCancelled(Exception):
+    """Raised when an index build is cancelled before it completes."""
+
+
+def check_cancelled(cancel: Optional[threading.Event]):
+    if cancel is not None and cancel.is_set():
+        raise IndexingCancelled("Indexing cancelled")
+
 
 def get_file_hash(file_path: str) -> str:
     """Generate a hash for a file."""
@@ -18,37 +49,267 @@ def get_file_hash(file_path: str) -> str:
     return file_hash.hexdigest()
 
 
+def is_chunk_boundary(piece: str) -> bool:
+    return int(hashlib.md5(piece.encode('utf-8')).hexdigest()[:8], 16) % BOUNDARY_MODULUS == 0
+
+
 class DocumentRetriever:
-    def __init__(self, embeddings: Embeddings):
+    def __init__(self, embeddings: Embeddings, scheduler=None, chunk_store=None,
+                 cache: EmbeddingCache = None):
         self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.chunk_store = chunk_store
+        self.cache = cache or EmbeddingCache(chunk_store=chunk_store)
         self.text_splitter = RecursiveCharacterTextSplitter(
-            separators=['.\n'],
-            chunk_size=1500,
+            separators=['.\n', '\n\n', '\n', ' '],
+            chunk_size=CHUNK_SIZE,
             chunk_overlap=50
         )
-        Path("embeddings").mkdir(exist_ok=True)
 
-    def get_or_create_embeddings(self, file_path: str) -> FAISS:
+    def get_or_create_embeddings(self, file_path: str, file_hash: str = None,
+                                 progress: ProgressCallback = None,
+                                 cancel: threading.Event = None) -> FAISS:
         """Get existing embeddings or create new ones for a file."""
-        file_hash = get_file_hash(file_path)
-        embedding_file = Path("embeddings") / f"{file_hash}.faiss"
+        file_hash = file_hash or get_file_hash(file_path)
+        embedding_file = self.cache.index_path(file_hash)
 
         if embedding_file.exists():
+            self.cache.touch(file_hash)
             return FAISS.load_local(str(embedding_file), self.embeddings, allow_dangerous_deserialization=True)
 
-        text = Path(file_path).read_text(encoding='utf-8')
-        documents = self.text_splitter.create_documents([text])
-        vector_db = FAISS.from_documents(documents, self.embeddings)
+        started = time.perf_counter()
+        checkpoint_file = self.cache.checkpoint_path(file_hash)
+        documents = self.load_documents(file_path, file_hash, progress, cancel)
+        vector_db = self.embed_documents(documents, progress, cancel, checkpoint_file)
         vector_db.save_local(str(embedding_file))
+        if self.chunk_store is not None:
+            self.chunk_store.link(file_hash, [doc.page_content for doc in documents])
+        checkpoint_file.unlink(missing_ok=True)
+        self.cache.record(file_hash, file_path, len(documents), time.perf_counter() - started)
 
         return vector_db
 
+    def embed_documents(self, documents: List[Document], progress: ProgressCallback = None,
+                        cancel: threading.Event = None, checkpoint_file: Path = None) -> FAISS:
+        """Embed chunks, reusing stored vectors for any chunk seen before."""
+        texts = [doc.page_content for doc in documents]
+        known = self.chunk_store.get_many(texts) if self.chunk_store is not None else {}
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        reused = sum(1 for text in texts if text in known)
+
+        def report(stage, done, total):
+            progress(stage, min(reused + done, len(texts)), len(texts))
+
+        if progress and reused:
+            report("chunks", 0, len(missing))
+        vectors = self.embed_texts(missing, report if progress else None, cancel, checkpoint_file)
+        if self.chunk_store is not None:
+            self.chunk_store.put_many(missing, vectors)
+        known.update(zip(missing, vectors))
+        if progress:
+            progress("chunks", len(texts), len(texts))
+
+        return FAISS.from_embeddings(
+            [(text, known[text]) for text in texts], self.embeddings,
+            metadatas=[doc.metadata for doc in documents]
+        )
+
+    def embed_texts(self, texts: List[str], progress: ProgressCallback = None,
+                    cancel: threading.Event = None, checkpoint_file: Path = None) -> List[List[float]]:
+        """Embed texts batch by batch so the build can report and be cancelled."""
+        if self.scheduler is not None:
+            return self.scheduler.embed(texts, progress, cancel, checkpoint_file)
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            check_cancelled(cancel)
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + EMBEDDING_BATCH_SIZE]))
+            if progress:
+                progress("chunks", len(vectors), len(texts))
+        return vectors
+
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunks whose boundaries depend only on nearby content."""
+        pieces = []
+        for piece in PIECE_BOUNDARY.split(text):
+            if len(piece) > CHUNK_SIZE:
+                pieces.extend(self.text_splitter.split_text(piece))
+            elif piece:
+                pieces.append(piece)
+
+        chunks = []
+        current = ""
+        for piece in pieces:
+            if current and len(current) + len(piece) > CHUNK_SIZE:
+                chunks.append(current)
+                current = ""
+            current += piece
+            if len(current) >= MIN_CHUNK_SIZE and is_chunk_boundary(piece):
+                chunks.append(current)
+                current = ""
+        if current.strip():
+            chunks.append(current)
+        return [chunk for chunk in chunks if chunk.strip()]
+
+    def create_documents(self, texts: List[str], metadatas: List[dict] = None) -> List[Document]:
+        metadatas = metadatas or [{} for _ in texts]
+        return [Document(page_content=chunk, metadata=dict(metadata))
+                for text, metadata in zip(texts, metadatas)
+                for chunk in self.split_text(text)]
+
+    def load_documents(self, file_path: str, file_hash: str, progress: ProgressCallback = None,
+                       cancel: threading.Event = None) -> List[Document]:
+        """Split a file into chunks; PDF chunks keep their page number."""
+        if file_path.lower().endswith('.pdf'):
+            pages = self.get_pdf_pages(file_path, file_hash, progress, cancel)
+            metadatas = [{"page": number} for number in range(1, len(pages) + 1)]
+            return self.create_documents(pages, metadatas)
+
+        text = Path(file_path).read_text(encoding='utf-8')
+        if progress:
+            progress("pages", 1, 1)
+        return self.create_documents([text])
+
+    def get_pdf_pages(self, file_path: str, file_hash: str, progress: ProgressCallback = None,
+                      cancel: threading.Event = None) -> List[str]:
+        """Extract the text of each PDF page, cached by file hash."""
+        pages_file = self.cache.pages_path(file_hash)
+        if pages_file.exists():
+            pages = json.loads(pages_file.read_text(encoding='utf-8'))
+            if progress:
+                progress("pages", len(pages), len(pages))
+            return pages
+
+        pages = []
+        with fitz.open(file_path) as document:
+            for page in document:
+                check_cancelled(cancel)
+                pages.append(page.get_text())
+                if progress:
+                    progress("pages", len(pages), document.page_count)
+        pages_file.write_text(json.dumps(pages), encoding='utf-8')
+        return pages
+
     def retrieve(self, query: str, file_path: str, top_k: int = 1) -> List[Document]:
         """Retrieve relevant documents based on the query."""
         vector_db = self.get_or_create_embeddings(file_path)
         return vector_db.similarity_search(query, k=top_k)
 
 
+def get_file_identity(file_path: str) -> Tuple[str, int, int]:
+    """Cheap identity for a file: resolved path, mtime and size."""
+    stat = os.stat(file_path)
+    return (str(Path(file_path).resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+def estimate_index_size(vector_db: FAISS) -> int:
+    """Approximate resident bytes of a loaded index: vectors plus chunk text."""
+    index = vector_db.index
+    size = index.ntotal * index.d * 4
+    for doc in vector_db.docstore._dict.values():
+        size += len(doc.page_content)
+    return size
+
+
+class RetrievalEngine:
+    """Long-lived retrieval service that keeps loaded indexes in memory.
+
+    Indexes are kept in an LRU keyed by content hash and capped at
+    ``max_bytes``. File identities (path, mtime, size) are mapped to their
+    content hash so an unchanged file is never re-hashed. Only one build
+    runs per file; other callers wait for it instead of starting their own,
+    and share its cancellation rather than building again behind it.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_bytes: int = 256 * 1024 * 1024,
+                 scheduler=None, chunk_store=None):
+        self.retriever = DocumentRetriever(embeddings, scheduler, chunk_store)
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, Tuple[FAISS, int]]" = OrderedDict()
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._building: Dict[str, threading.Event] = {}
+        # Builds that were cancelled, so the callers waiting on them give up too
+        self._cancelled_builds = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_file_hash(self, file_path: str) -> str:
+        """Content hash of a file, computed once per file identity."""
+        identity = get_file_identity(file_path)
+        with self._lock:
+            file_hash = self._hashes.get(identity)
+        if file_hash is None:
+            file_hash = get_file_hash(file_path)
+            with self._lock:
+                self._hashes[identity] = file_hash
+        return file_hash
+
+    def get_index(self, file_path: str, progress: ProgressCallback = None,
+                  cancel: threading.Event = None) -> FAISS:
+        """Return the index for a file, loading or building it on a miss."""
+        file_hash = self.get_file_hash(file_path)
+        counted = False
+        while True:
+            with self._lock:
+                entry = self._indexes.get(file_hash)
+                if entry is not None:
+                    self._indexes.move_to_end(file_hash)
+                    self.retriever.cache.touch(file_hash)
+                    if not counted:
+                        self.hits += 1
+                    return entry[0]
+                if not counted:
+                    self.misses += 1
+                    counted = True
+                build = self._building.get(file_hash)
+                if build is None:
+                    build = self._building[file_hash] = threading.Event()
+                    break
+            # Another thread is building this index; wait and re-check.
+            build.wait()
+            if build in self._cancelled_builds:
+                raise IndexingCancelled(f"Indexing of {os.path.basename(file_path)} was cancelled")
+
+        try:
+            vector_db = self.retriever.get_or_create_embeddings(file_path, file_hash, progress, cancel)
+            with self._lock:
+                self._indexes[file_hash] = (vector_db, estimate_index_size(vector_db))
+                self._evict()
+            return vector_db
+        except IndexingCancelled:
+            self._cancelled_builds.add(build)
+            raise
+        finally:
+            with self._lock:
+                del self._building[file_hash]
+            build.set()
+
+    def _evict(self):
+        """Drop least recently used indexes until under the memory cap."""
+        while len(self._indexes) > 1 and self.memory_usage() > self.max_bytes:
+            self._indexes.popitem(last=False)
+            self.evictions += 1
+
+    def memory_usage(self) -> int:
+        return sum(size for _, size in self._indexes.values())
+
+    def retrieve(self, query: str, file_path: str, top_k: int = 1) -> List[Document]:
+        """Retrieve relevant documents based on the query."""
+        return self.get_index(file_path).similarity_search(query, k=top_k)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "loaded": len(self._indexes),
+                "bytes": self.memory_usage(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
 def main():
     api_key = os.getenv('OPENAI_API_KEY')
     embeddings = OpenAIEmbeddings(api_key=api_key)
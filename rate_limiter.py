@@ -0,0 +1,154 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Callable, Mapping, Optional
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+# Failures worth retrying after a backoff: 429, 5xx, dropped connections and timeouts
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+RESET_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+RESET_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parse an OpenAI reset header such as "6m0s", "1.5s" or "20ms" into seconds."""
+    if not value:
+        return None
+    parts = RESET_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * RESET_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds the server asked us to wait, if it said so."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    return parse_reset(headers.get("retry-after"))
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket that can be re-synced from rate-limit headers.
+
+    ``rate`` is in tokens per second. Limits reported by OpenAI are per
+    minute, so ``update`` derives the rate from ``limit / 60``.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take ``amount`` tokens if there are enough and return 0; otherwise
+        take nothing and return the seconds until there should be."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            amount = min(amount, self.capacity)
+            if now >= self.blocked_until and self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return max(self.blocked_until - now, (amount - self.tokens) / self.rate)
+
+    def acquire(self, amount: float = 1, should_stop: Callable[[], bool] = None) -> bool:
+        """Block until ``amount`` tokens are taken; False if ``should_stop`` fired first."""
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return True
+            if should_stop is not None and should_stop():
+                return False
+            time.sleep(min(wait, 0.1))
+
+    def update(self, limit: Optional[float] = None, remaining: Optional[float] = None,
+               reset: Optional[float] = None):
+        """Adopt the server's view of the limit, what is left and when it resets."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit:
+                self.capacity = limit
+                self.rate = limit / 60.0
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+
+    def update_from_headers(self, headers: Mapping[str, str], kind: str):
+        """Sync from ``x-ratelimit-*-<kind>`` headers, kind being "requests" or "tokens"."""
+        def number(name):
+            value = headers.get(f"x-ratelimit-{name}-{kind}")
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.update(number("limit"), number("remaining"),
+                    parse_reset(headers.get(f"x-ratelimit-reset-{kind}")))
+
+
+class ModelBudget:
+    """Request and token buckets of one model, synced from rate-limit headers."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute / 60.0, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+
+    def acquire(self, tokens: float, should_stop: Callable[[], bool] = None) -> bool:
+        """Block until one request and ``tokens`` tokens are taken; False if ``should_stop`` fired first."""
+        return self.requests.acquire(1, should_stop) and self.tokens.acquire(tokens, should_stop)
+
+    async def acquire_async(self, tokens: float):
+        """``acquire`` for coroutines; cancel the task to give up."""
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            while True:
+                wait = bucket.try_acquire(amount)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, 0.1))
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        self.requests.update_from_headers(headers, "requests")
+        self.tokens.update_from_headers(headers, "tokens")
+
+    def back_off(self, error: Exception, attempt: int, max_retries: int) -> float:
+        """Hold back every request to this model after a retryable failure.
+
+        Returns the delay before the next attempt, ``retry-after`` or an
+        exponential backoff with jitter; re-raises ``error`` when ``attempt``
+        was the last one.
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            self.update_from_headers(headers)
+        if attempt == max_retries:
+            raise error
+        delay = retry_after(headers) or backoff_delay(attempt)
+        self.requests.update(remaining=0, reset=delay)
+        return delay
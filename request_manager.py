@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Dict, List
+
+from PySide6.QtCore import QObject, QThreadPool, Signal
+
+# Queue waits remembered for the stats
+WAIT_SAMPLES = 100
+
+
+class RequestManager(QObject):
+    """Chat requests in flight, by conversation, run on a bounded thread pool.
+
+    A request is a QObject with a ``conversation`` attribute, ``run()``,
+    ``wait(timeout)``, a ``finished`` signal and a ``cancel()`` method that
+    aborts it, e.g. by closing its HTTP stream. At most ``max_concurrent``
+    requests run at once; the rest wait in the pool's queue. Requests of
+    one conversation run one after the other, in the order they were
+    started. Requests marked ``asynchronous`` only schedule themselves on
+    an event loop in ``run(slots)``, so they are run directly instead of on
+    the pool; ``slots`` is an asyncio.Semaphore of ``max_concurrent`` they
+    hold while running, and ``started_at`` is set once they get one.
+    Requests stay registered until they finish, whether they completed,
+    failed or were cancelled.
+    """
+    # Emitted with the conversation whenever one of its requests starts or finishes
+    requests_changed = Signal(object)
+
+    def __init__(self, max_concurrent: int = 4, parent=None):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_concurrent)
+        # The pool's limit for asynchronous requests, taken on the event loop
+        self.async_slots = asyncio.Semaphore(max_concurrent)
+        # conversation id -> its requests in order; only the first is in the pool
+        self._requests: Dict[str, List] = {}
+        self._dispatched = set()
+        self._waits: List[float] = []
+        self.submitted = 0
+        self.completed = 0
+
+    def start(self, request):
+        request.queued_at = time.perf_counter()
+        requests = self._requests.setdefault(request.conversation.id, [])
+        requests.append(request)
+        request.finished.connect(lambda: self._finished(request))
+        self.submitted += 1
+        if len(requests) == 1:
+            self._dispatch(request)
+        self.requests_changed.emit(request.conversation)
+
+    def _dispatch(self, request):
+        self._dispatched.add(request)
+        if request.asynchronous:
+            request.run(self.async_slots)
+        else:
+            self._pool.start(request.run)
+
+    def _finished(self, request):
+        requests = self._requests.get(request.conversation.id, [])
+        if request in requests:
+            requests.remove(request)
+        self._dispatched.discard(request)
+        if request.started_at is not None:
+            self._waits = (self._waits + [request.started_at - request.queued_at])[-WAIT_SAMPLES:]
+        self.completed += 1
+        if requests and requests[0] not in self._dispatched:
+            self._dispatch(requests[0])
+        elif not requests:
+            self._requests.pop(request.conversation.id, None)
+        request.deleteLater()
+        self.requests_changed.emit(request.conversation)
+
+    def active(self, conversation) -> List:
+        return list(self._requests.get(conversation.id, []))
+
+    def is_active(self, conversation) -> bool:
+        return conversation.id in self._requests
+
+    def cancel(self, conversation) -> int:
+        """Cancel the conversation's requests; returns how many there were."""
+        requests = self.active(conversation)
+        # Newest first, so cancelling the running one does not start the next
+        for request in reversed(requests):
+            request.cancel()
+        return len(requests)
+
+    def cancel_all(self):
+        for requests in list(self._requests.values()):
+            for request in reversed(requests):
+                request.cancel()
+
+    def wait_all(self, timeout_ms: int = 2000):
+        deadline = time.perf_counter() + timeout_ms / 1000
+        for requests in list(self._requests.values()):
+            for request in requests:
+                request.wait(max(0.0, deadline - time.perf_counter()))
+
+    def count(self) -> int:
+        return sum(len(requests) for requests in self._requests.values())
+
+    def stats(self) -> Dict[str, float]:
+        requests = [request for queue in self._requests.values() for request in queue]
+        running = sum(1 for request in requests if request.started_at is not None)
+        return {
+            "running": running,
+            "waiting": len(requests) - running,
+            "max_concurrent": self._pool.maxThreadCount(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "average_wait_ms": 1000 * sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            "max_wait_ms": 1000 * max(self._waits) if self._waits else 0.0,
+        }
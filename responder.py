@@ -1,38 +1,183 @@
-from openai import OpenAI
+import os
+import re
+
 from langchain_openai import OpenAIEmbeddings
-from rag import DocumentRetriever
+from openai_client import SharedAsyncClient, SharedClient
+from rag import RetrievalEngine
+from embedding_scheduler import EmbeddingScheduler
+from chunk_store import ChunkStore
+
+
+def create_retrieval_engine(shared_client):
+    embeddings = OpenAIEmbeddings(api_key=shared_client.get().api_key,
+                                  http_client=shared_client.get_http_client())
+    scheduler = EmbeddingScheduler(shared_client.get(), model=embeddings.model)
+    return RetrievalEngine(embeddings, scheduler=scheduler, chunk_store=ChunkStore(embeddings.model))
+
+
+RAG_PROMPT = "answer this query: {query} using following context \n {contents}"
+
+# Older histories stored the augmented prompt in place of the user's text
+RAG_PROMPT_PATTERN = re.compile(r"^answer this query: (.*?) using following context \n", re.S)
+
+
+def strip_rag_context(content):
+    """Recover the user's own text from a stored RAG prompt."""
+    match = RAG_PROMPT_PATTERN.match(content)
+    return match.group(1) if match else content
+
+
+def to_api_messages(messages):
+    """Drop app-only keys such as "sources" before sending messages to the API."""
+    return [{"role": message["role"], "content": message["content"]} for message in messages]
+
+
+def source_reference(file_path, doc):
+    reference = {"file": os.path.basename(file_path)}
+    if doc.metadata.get("page") is not None:
+        reference["page"] = doc.metadata["page"]
+    return reference
+
+
+def format_source(doc):
+    page = doc.metadata.get("page")
+    if page is None:
+        return doc.page_content
+    return f"[page {page}] {doc.page_content}"
 
 
 class ChatGPT:
-    def __init__(self, openai_api_key, model="gpt-3.5-turbo"):
-        self.openai_api_key = openai_api_key
-        self.client = OpenAI(api_key=openai_api_key)
+    def __init__(self, openai_api_key=None, model="gpt-3.5-turbo", retrieval_engine=None,
+                 shared_client=None):
+        self.shared_client = shared_client or SharedClient(openai_api_key)
         self.model = model
+        self.retrieval_engine = retrieval_engine
+
+    @property
+    def client(self):
+        return self.shared_client.get()
 
-    def create_chat_completion(self, messages, **kwargs):
+    @property
+    def scheduler(self):
+        return self.shared_client.scheduler
+
+    def create_chat_completion(self, messages, model=None, **kwargs):
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+            response = self.scheduler.create(
+                self.client,
+                model=model or self.model,
+                messages=to_api_messages(messages),
                 **kwargs
             )
             return response.choices[0].message.content
         except Exception as e:
             raise Exception(f"ChatGPT API error: {str(e)}")
 
+    def stream_chat_completion(self, messages, on_open=None, on_retry=None, should_stop=None, **kwargs):
+        """Yield the completion text delta by delta as it arrives.
+
+        ``on_open`` is called with the response stream once it is open;
+        closing it from another thread aborts the HTTP request. ``on_retry``
+        hears about retries while opening, and ``should_stop`` ends waiting
+        for rate-limit budget (see ChatScheduler).
+        """
+        try:
+            stream = self.scheduler.create(
+                self.client,
+                on_retry=on_retry,
+                should_stop=should_stop,
+                model=self.model,
+                messages=to_api_messages(messages),
+                stream=True,
+                **kwargs
+            )
+            if on_open is not None:
+                on_open(stream)
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise Exception(f"ChatGPT API error: {str(e)}")
+
     def get_file_contents(self, file_path, query, top_k=2,**kwargs):
+        contents, _ = self.get_file_context(file_path, query, top_k)
+        return contents
+
+    def get_file_context(self, file_path, query, top_k=2):
+        """Return the top-k chunks for a query and compact references to them."""
         try:
-            embeddings = OpenAIEmbeddings(api_key=self.openai_api_key)
-            retriever = DocumentRetriever(embeddings)
+            if self.retrieval_engine is None:
+                self.retrieval_engine = create_retrieval_engine(self.shared_client)
 
-            results = retriever.retrieve(query, file_path, top_k)
+            results = self.retrieval_engine.retrieve(query, file_path, top_k)
+
+            contents = [format_source(doc) for doc in results]
+            sources = []
+            for doc in results:
+                reference = source_reference(file_path, doc)
+                if reference not in sources:
+                    sources.append(reference)
+
+            return contents, sources
 
-            contents = [doc.page_content for doc in results]
-            
-            return contents
-             
         except Exception as e:
             raise Exception(f"RAG error: {str(e)}")
-        
-    
-    
\ No newline at end of file
+
+
+class AsyncChatGPT:
+    """ChatGPT on ``AsyncOpenAI``: chat turns, titles and summaries as coroutines.
+
+    They run on the shared client's event loop, so any number of them can be
+    in flight at once over its connection pool without a thread each.
+    """
+
+    def __init__(self, shared_client: SharedAsyncClient, model="gpt-3.5-turbo"):
+        self.shared_client = shared_client
+        self.model = model
+
+    @property
+    def client(self):
+        return self.shared_client.get()
+
+    def submit(self, coroutine):
+        """Run a coroutine on the event loop; returns a concurrent future."""
+        return self.shared_client.submit(coroutine)
+
+    @property
+    def scheduler(self):
+        return self.shared_client.scheduler
+
+    async def create_chat_completion(self, messages, model=None, **kwargs):
+        try:
+            response = await self.scheduler.create_async(
+                self.client,
+                model=model or self.model,
+                messages=to_api_messages(messages),
+                **kwargs
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            raise Exception(f"ChatGPT API error: {str(e)}")
+
+    async def stream_chat_completion(self, messages, on_retry=None, **kwargs):
+        """Yield the completion text delta by delta as it arrives.
+
+        Cancelling the consuming task closes the response stream.
+        """
+        try:
+            stream = await self.scheduler.create_async(
+                self.client,
+                on_retry=on_retry,
+                model=self.model,
+                messages=to_api_messages(messages),
+                stream=True,
+                **kwargs
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+        except Exception as e:
+            raise Exception(f"ChatGPT API error: {str(e)}")
@@ -0,0 +1,290 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    summary TEXT,
+    created_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (conversation_id, seq)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+"""
+SCHEMA_VERSION = 3
+
+SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+
+# Above this many matching messages search results are not ranked by relevance
+MAX_RANKED_MATCHES = 5000
+
+
+def message_row(conversation_id: str, seq: int, message: Dict):
+    extra = {key: value for key, value in message.items() if key not in ("role", "content")}
+    return (conversation_id, seq, message["role"], message["content"],
+            json.dumps(extra) if extra else None)
+
+
+def row_message(role: str, content: str, extra: str) -> Dict:
+    message = {"role": role, "content": content}
+    if extra:
+        message.update(json.loads(extra))
+    return message
+
+
+class ConversationStore:
+    """SQLite (WAL) storage for conversations in their ``to_dict`` shape.
+
+    ``save`` writes the conversation row and appends only the messages not
+    yet stored, so a reply costs one row however long the history is.
+    ``load_index`` reads conversation metadata only; messages are read per
+    conversation with ``load_messages``. Message text is kept in an FTS5
+    index, maintained by triggers as rows are appended, for ``search``.
+    """
+
+    def __init__(self, path: Path = Path("conversations.db")):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self._upgrade_schema()
+        # Searches get their own connection so they can be interrupted, and
+        # (with WAL) never wait for a write
+        self._search_lock = threading.Lock()
+        self._search_db = sqlite3.connect(str(self.path), check_same_thread=False)
+        # conversation id -> number of its messages already stored
+        self._stored_counts: Dict[str, int] = {}
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM conversations LIMIT 1").fetchone() is None
+
+    def _upgrade_schema(self):
+        version, = self._db.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(conversations)")]
+        with self._db:
+            if version < 3:
+                # Messages stored before the full-text index existed
+                self._db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            if "message_count" not in columns:
+                self._db.execute("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+                self._db.execute(
+                    "UPDATE conversations SET message_count ="
+                    " (SELECT COUNT(*) FROM messages WHERE conversation_id = conversations.id)"
+                )
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def load_index(self) -> List[Dict]:
+        """Metadata of every conversation, without messages."""
+        with self._lock:
+            index = []
+            for conversation_id, title, summary, created_at, message_count in self._db.execute(
+                    "SELECT id, title, summary, created_at, message_count FROM conversations ORDER BY rowid"):
+                index.append({
+                    "id": conversation_id,
+                    "title": title,
+                    "summary": json.loads(summary) if summary else None,
+                    "created_at": created_at,
+                    "message_count": message_count,
+                })
+                self._stored_counts[conversation_id] = message_count
+        return index
+
+    def load_messages(self, conversation_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """The conversation's messages in order, or only the first ``limit`` of them."""
+        with self._lock:
+            return [row_message(role, content, extra) for role, content, extra in self._db.execute(
+                "SELECT role, content, extra FROM messages WHERE conversation_id = ? ORDER BY seq LIMIT ?",
+                (conversation_id, -1 if limit is None else limit))]
+
+    def save(self, data: Dict):
+        """Upsert a conversation and append its new messages."""
+        with self._lock, self._db:
+            self._save(data)
+
+    def _save(self, data: Dict):
+        conversation_id = data["id"]
+        summary = json.dumps(data["summary"]) if data.get("summary") else None
+        stored = self._stored_count(conversation_id)
+        # Conversations whose messages are not loaded have nothing new to append
+        new_messages = data["messages"][stored:] if data.get("messages") is not None else []
+        self._db.execute(
+            "INSERT INTO conversations (id, title, summary, created_at, message_count)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET title = excluded.title, summary = excluded.summary,"
+            " message_count = excluded.message_count",
+            (conversation_id, data["title"], summary, data["created_at"], stored + len(new_messages)),
+        )
+        self._db.executemany(
+            "INSERT INTO messages (conversation_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+            [message_row(conversation_id, seq, message)
+             for seq, message in enumerate(new_messages, stored)],
+        )
+        self._stored_counts[conversation_id] = stored + len(new_messages)
+
+    def stored_count(self, conversation_id: str) -> int:
+        with self._lock:
+            return self._stored_count(conversation_id)
+
+    def _stored_count(self, conversation_id: str) -> int:
+        if conversation_id not in self._stored_counts:
+            count, = self._db.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            self._stored_counts[conversation_id] = count
+        return self._stored_counts[conversation_id]
+
+    def search(self, query: str, limit: int = 50, mark=("[", "]")) -> List[Dict]:
+        """Messages matching every word of ``query``, best match first.
+
+        The last word matches as a prefix so results follow typing. Queries
+        matching more than ``MAX_RANKED_MATCHES`` messages return the newest
+        matches instead of the most relevant. Each hit
+        carries the conversation id, the message's position in it and a
+        snippet with the matched words wrapped in ``mark``.
+        """
+        terms = SEARCH_TERM.findall(query)
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms) + "*"
+        with self._search_lock:
+            count, = self._search_db.execute(
+                "SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?", (match,)
+            ).fetchone()
+            # Scoring every hit of a very broad query is too slow; list those newest first
+            order = "rank" if count <= MAX_RANKED_MATCHES else "rowid DESC"
+            # Rank and cut inside FTS first; the join only sees the top hits
+            rows = self._search_db.execute(
+                "SELECT m.conversation_id, m.seq, m.role, hits.snippet FROM ("
+                "  SELECT rowid, rank, snippet(messages_fts, 0, ?, ?, '…', 12) AS snippet"
+                f"  FROM messages_fts WHERE messages_fts MATCH ? ORDER BY {order} LIMIT ?"
+                f") AS hits JOIN messages m ON m.rowid = hits.rowid ORDER BY hits.{order}",
+                (mark[0], mark[1], match, limit),
+            ).fetchall()
+        return [{"conversation_id": conversation_id, "seq": seq, "role": role, "snippet": snippet}
+                for conversation_id, seq, role, snippet in rows]
+
+    def interrupt_search(self):
+        """Abort a running ``search``; it raises ``sqlite3.OperationalError``."""
+        self._search_db.interrupt()
+
+    def delete(self, conversation_id: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._stored_counts.pop(conversation_id, None)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM conversations")
+            self._stored_counts.clear()
+
+    def migrate_from_json(self, data: List[Dict], json_path: Path):
+        """One-time import of the conversations.json written by older versions.
+
+        The import is one transaction, so an interrupted one leaves the store
+        empty and is retried on the next start. The file is renamed to
+        ``*.migrated`` afterwards, kept as a backup but never imported twice.
+        """
+        json_path = Path(json_path)
+        with self._lock:
+            try:
+                with self._db:
+                    for conversation in data:
+                        self._save(conversation)
+            except Exception:
+                self._stored_counts.clear()
+                raise
+        os.replace(json_path, json_path.with_name(json_path.name + ".migrated"))
+
+
+class ConversationCache:
+    """Bounds how many conversations keep their messages in memory.
+
+    Conversations load their messages through ``load`` on first access; the
+    least recently loaded ones are unloaded again once more than
+    ``max_resident`` are in memory. Pinned conversations and ones with
+    messages not yet saved are never unloaded. Loading may unload other
+    conversations, so it only happens on the GUI thread; background jobs are
+    handed a copy of the messages they need.
+    """
+
+    def __init__(self, store: ConversationStore, max_resident: int = 20):
+        self.store = store
+        self.max_resident = max_resident
+        self._resident: "OrderedDict[str, object]" = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    def load(self, conversation) -> List[Dict]:
+        with self._lock:
+            messages = self.store.load_messages(conversation.id)
+            self.loads += 1
+            self._resident[conversation.id] = conversation
+            self._resident.move_to_end(conversation.id)
+            self._evict(keep=conversation.id)
+            return messages
+
+    def touch(self, conversation):
+        with self._lock:
+            if conversation.id in self._resident:
+                self._resident.move_to_end(conversation.id)
+
+    def pin(self, conversation):
+        with self._lock:
+            self._pinned.add(conversation.id)
+            # New conversations never go through load but still count as resident
+            self._resident[conversation.id] = conversation
+            self._resident.move_to_end(conversation.id)
+
+    def unpin(self, conversation):
+        with self._lock:
+            self._pinned.discard(conversation.id)
+            self._evict()
+
+    def forget(self, conversation):
+        with self._lock:
+            self._resident.pop(conversation.id, None)
+            self._pinned.discard(conversation.id)
+
+    def _evict(self, keep: str = None):
+        for conversation_id in list(self._resident):
+            if len(self._resident) <= self.max_resident:
+                break
+            conversation = self._resident[conversation_id]
+            if conversation_id in self._pinned or conversation_id == keep:
+                continue
+            if conversation.message_count() > self.store.stored_count(conversation_id):
+                continue
+            conversation.unload()
+            del self._resident[conversation_id]
+            self.evictions += 1